@@ -0,0 +1,112 @@
+# Benchmark of the fuzzy book search index (utils/search.py).
+# Builds the index over synthetic titles / authors and times misspelled queries against it.
+# Run from the project root: python benchmarks/bench_fuzzy_search.py --books 1000000
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.search import TrigramIndex
+
+# English like syllables (onset + vowel + coda) give a realistic spread of trigrams
+ONSETS = ["", "b", "c", "d", "f", "g", "h", "j", "k", "l", "m", "n", "p", "r", "s", "t", "v", "w", "y", "z",
+          "br", "ch", "cl", "cr", "dr", "fl", "gr", "pl", "pr", "sh", "sl", "st", "th", "tr", "wh"]
+VOWELS = ["a", "e", "i", "o", "u", "ai", "ea", "ee", "ie", "oo", "ou"]
+CODAS = ["", "n", "r", "s", "t", "l", "m", "nd", "ng", "st", "ck", "rd", "th"]
+# Very common title words, these give the long posting lists a real catalogue has
+STOP_WORDS = ["the", "of", "and", "a", "in", "to", "for", "with"]
+
+
+def make_words(rng, count):
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choice(ONSETS) + rng.choice(VOWELS) + rng.choice(CODAS)
+                          for _ in range(rng.randint(1, 3))))
+    return sorted(words)
+
+
+def make_title(rng, words):
+    title = [rng.choice(words) for _ in range(rng.randint(1, 4))]
+    if rng.random() < 0.4:
+        title.insert(0, "the")
+    if len(title) > 2 and rng.random() < 0.5:
+        title.insert(rng.randrange(1, len(title)), rng.choice(STOP_WORDS))
+    return " ".join(title).title()
+
+
+# Swaps, drops or doubles one letter, the usual kinds of typos
+def misspell(rng, text):
+    chars = list(text)
+    if len(chars) < 4:
+        return text
+    i = rng.randrange(1, len(chars) - 2)
+    kind = rng.choice(["swap", "drop", "double"])
+    if kind == "swap":
+        chars[i], chars[i + 1] = chars[i + 1], chars[i]
+    elif kind == "drop":
+        del chars[i]
+    else:
+        chars.insert(i, chars[i])
+    return "".join(chars)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--books", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    words = make_words(rng, 50000)
+    names = make_words(rng, 20000)
+
+    books = []
+    for book_id in range(1, args.books + 1):
+        title = make_title(rng, words)
+        author = f"{rng.choice(names).title()} {rng.choice(names).title()}"
+        books.append((book_id, title, author))
+
+    index = TrigramIndex()
+    start = time.perf_counter()
+    for book_id, title, author in books:
+        index.add(book_id, title, author)
+    build_seconds = time.perf_counter() - start
+    print(f"indexed {len(index)} books in {build_seconds:.1f}s ({len(index) / build_seconds:,.0f} books/s)")
+
+    queries = []
+    for _ in range(args.queries * 2):
+        book_id, title, author = rng.choice(books)
+        source = rng.choice([title, author, author.split()[-1]])
+        queries.append((book_id, misspell(rng, source)))
+    warmup, queries = queries[:args.queries], queries[args.queries:]
+
+    # bitmaps of the common trigrams are built on their first use, like a long running server has them
+    start = time.perf_counter()
+    for book_id, query in warmup:
+        index.search(query, limit=20)
+    print(f"warm up with {len(warmup)} other queries took {time.perf_counter() - start:.1f}s")
+
+    timings = []
+    hits = 0
+    for book_id, query in queries:
+        start = time.perf_counter()
+        results = index.search(query, limit=20)
+        timings.append((time.perf_counter() - start) * 1000)
+        hits += any(found == book_id for found, similarity in results)
+
+    timings.sort()
+    print(f"{len(queries)} misspelled queries: "
+          f"p50 {statistics.median(timings):.2f} ms, "
+          f"p95 {timings[int(len(timings) * 0.95)]:.2f} ms, "
+          f"p99 {timings[int(len(timings) * 0.99)]:.2f} ms, "
+          f"mean {statistics.fmean(timings):.2f} ms")
+    print(f"intended book in top 20 for {hits / len(queries):.0%} of queries")
+
+
+if __name__ == "__main__":
+    main()
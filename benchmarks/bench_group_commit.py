@@ -0,0 +1,109 @@
+# Benchmark of checkout / return throughput on sqlite, committing every write on its own versus the
+# group commit writer (utils/group_commit.py).
+# Run from the project root: python benchmarks/bench_group_commit.py --threads 32 --seconds 10
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--threads", type=int, default=32)
+parser.add_argument("--seconds", type=float, default=10)
+parser.add_argument("--dir", default=None, help="directory for the sqlite file, use a real disk to see fsync costs")
+args = parser.parse_args()
+
+# the database module reads its url at import time
+workdir = tempfile.mkdtemp(dir=args.dir)
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import SessionLocal, library_engine
+import models
+import schemas
+from routers.transactions import _checkout, _return_book
+from utils.group_commit import GroupCommitWriter
+
+models.Base.metadata.create_all(bind=library_engine)
+
+
+def setup():
+    db = SessionLocal()
+    for i in range(args.threads):
+        db.add(models.User(id=i + 1, name=f"user {i}", email=f"user{i}@example.com", password="x"))
+        db.add(models.Book(id=i + 1, title=f"book {i}", author="author", isbn=f"isbn-{i}",
+                           published_year=2000, category="bench", quantity=1))
+    db.commit()
+    db.close()
+
+
+# Every thread checks out and returns its own book in a loop, so requests never conflict logically
+# and only the commit path is measured
+def run(mode):
+    # start every mode with all the books on the shelf
+    db = SessionLocal()
+    db.query(models.Transaction).delete()
+    db.query(models.Book).update({models.Book.quantity: 1})
+    db.commit()
+    db.close()
+
+    due_date = datetime.utcnow() + timedelta(days=14)
+    writer = GroupCommitWriter(max_batch=64, max_wait_ms=2) if mode == "group" else None
+    done, errors, latencies = [0], [0], []
+    lock = threading.Lock()
+    stop = time.monotonic() + args.seconds
+
+    def write(operation):
+        if writer:
+            return writer.submit(operation)
+        db = SessionLocal()
+        try:
+            result = operation(db)
+            db.commit()
+            return result
+        finally:
+            db.close()
+
+    def worker(user_id):
+        checkout = schemas.TransactionCreate(book_id=user_id, due_date=due_date)
+        book_return = schemas.BookReturnById(book_id=user_id)
+        borrowed = False
+        while time.monotonic() < stop:
+            if borrowed:
+                operation = lambda db: _return_book(db, user_id, book_return)
+            else:
+                operation = lambda db: _checkout(db, user_id, checkout)
+            start = time.perf_counter()
+            try:
+                write(operation)
+                borrowed = not borrowed
+                with lock:
+                    done[0] += 1
+                    latencies.append(time.perf_counter() - start)
+            except Exception:
+                # "database is locked" and the like, the request would have failed and is retried
+                with lock:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker, args=(i + 1,)) for i in range(args.threads)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0
+    print(f"{mode:>10}: {done[0] / elapsed:8.0f} writes/s, {errors[0]} failed, "
+          f"latency p50 {p50:.1f} ms, p99 {p99:.1f} ms")
+
+
+if __name__ == "__main__":
+    setup()
+    print(f"{args.threads} threads, {args.seconds:.0f}s per mode, database in {workdir}")
+    run("per-write")
+    run("group")
@@ -0,0 +1,70 @@
+# Benchmark of the overdue report (utils/overdue.py) over a large loan table in sqlite.
+# Run from the project root: python benchmarks/bench_overdue_report.py --loans 2000000
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--loans", type=int, default=2000000)
+parser.add_argument("--users", type=int, default=100000)
+parser.add_argument("--books", type=int, default=50000)
+parser.add_argument("--dir", default=None)
+args = parser.parse_args()
+
+# the database module reads its url at import time
+workdir = tempfile.mkdtemp(dir=args.dir)
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import SessionLocal, library_engine
+import models
+import schemas
+from utils.overdue import compute_overdue_report
+
+CATEGORIES = ["fiction", "science", "history", "children", "reference", "comics"]
+
+
+def setup(rng, now):
+    models.Base.metadata.create_all(bind=library_engine)
+    with library_engine.begin() as connection:
+        connection.execute(models.Book.__table__.insert(), [
+            {"id": i, "title": f"book {i}", "author": "author", "isbn": f"isbn-{i}", "published_year": 2000,
+             "category": rng.choice(CATEGORIES), "quantity": 1}
+            for i in range(1, args.books + 1)
+        ])
+        batch = []
+        for i in range(args.loans):
+            checkout = now - timedelta(days=rng.randint(0, 400), seconds=rng.randint(0, 86400))
+            batch.append({"user_id": rng.randint(1, args.users), "book_id": rng.randint(1, args.books),
+                          "checkout_date": checkout, "due_date": checkout + timedelta(days=14),
+                          "is_returned": rng.random() < 0.3})
+            if len(batch) == 100000:
+                connection.execute(models.Transaction.__table__.insert(), batch)
+                batch = []
+        if batch:
+            connection.execute(models.Transaction.__table__.insert(), batch)
+
+
+if __name__ == "__main__":
+    rng = random.Random(11)
+    now = datetime.utcnow()
+
+    start = time.perf_counter()
+    setup(rng, now)
+    print(f"inserted {args.loans:,} loans in {time.perf_counter() - start:.1f}s ({workdir})")
+
+    rules = schemas.FineRules(daily_rate=0.25, category_rates={"reference": 1.0, "children": 0.1},
+                              grace_days=3, max_fine_per_loan=20, max_fine_per_user=100)
+    db = SessionLocal()
+    start = time.perf_counter()
+    report = compute_overdue_report(db, rules, now)
+    elapsed = time.perf_counter() - start
+    db.close()
+
+    overdue = int(report["overdue_books"].sum())
+    print(f"report over {overdue:,} overdue loans of {len(report['user_id']):,} users in {elapsed:.2f}s "
+          f"({overdue / elapsed:,.0f} loans/s), total fine {report['fine'].sum():,.2f}")
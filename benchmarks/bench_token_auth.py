@@ -0,0 +1,111 @@
+# Benchmark of authenticated requests, the old token check (user looked up in the database on every
+# request) against the claims based verify_token in middleware.py.
+# Run from the project root: python benchmarks/bench_token_auth.py --requests 5000
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--requests", type=int, default=5000)
+parser.add_argument("--users", type=int, default=10000)
+args = parser.parse_args()
+
+# the database module reads its url at import time
+workdir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials
+from fastapi.testclient import TestClient
+from jose import JWTError, jwt
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, library_engine, get_db_connection
+import models
+from middleware import verify_token, create_access_token, security, SECRET_KEY, ALGORITHM
+
+
+# verify_token as it was before the token claims, one user query per request
+def legacy_verify_token(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db_connection)):
+    credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+    try:
+        email = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+        if email is None:
+            raise credentials_exception
+    except JWTError:
+        raise credentials_exception
+    user = db.query(models.User).filter(models.User.email == email).first()
+    if user is None:
+        raise credentials_exception
+    return user
+
+
+app = FastAPI()
+
+
+@app.get("/before")
+def before(current_user=Depends(legacy_verify_token)):
+    return {"id": current_user.id}
+
+
+@app.get("/after")
+def after(current_user=Depends(verify_token)):
+    return {"id": current_user.id}
+
+
+def setup():
+    models.Base.metadata.create_all(bind=library_engine)
+    with library_engine.begin() as connection:
+        connection.execute(models.User.__table__.insert(), [
+            {"id": i, "name": f"user {i}", "email": f"user{i}@example.com", "password": "x", "role": "user"}
+            for i in range(1, args.users + 1)
+        ])
+    user_id = args.users // 2
+    return create_access_token(
+        data={"sub": f"user{user_id}@example.com", "uid": user_id, "role": "user", "gen": 0},
+        expires_delta=timedelta(minutes=30)
+    )
+
+
+def measure(client, path, headers):
+    # warm up, the first call also loads the token generations
+    for _ in range(50):
+        assert client.get(path, headers=headers).status_code == 200
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        client.get(path, headers=headers)
+    elapsed = time.perf_counter() - start
+    return args.requests / elapsed
+
+
+if __name__ == "__main__":
+    token = setup()
+    headers = {"Authorization": f"Bearer {token}"}
+
+    # rounds alternate between the two so drift of the test client hits both alike, best round is kept
+    before_rate = after_rate = 0
+    with TestClient(app) as client:
+        for _ in range(3):
+            before_rate = max(before_rate, measure(client, "/before", headers))
+            after_rate = max(after_rate, measure(client, "/after", headers))
+    print(f"3 rounds of {args.requests} authenticated requests each, {args.users} users, sqlite in {workdir}")
+    print(f"  database lookup (before): {before_rate:8.0f} requests/s")
+    print(f"  token claims    (after):  {after_rate:8.0f} requests/s  ({after_rate / before_rate:.2f}x)")
+
+    # the dependency alone, without the HTTP stack around it
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        db = SessionLocal()
+        legacy_verify_token(credentials, db)
+        db.close()
+    before_call = (time.perf_counter() - start) / args.requests * 1e6
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        verify_token(credentials)
+    after_call = (time.perf_counter() - start) / args.requests * 1e6
+    print(f"  dependency only: {before_call:.0f} us before, {after_call:.0f} us after")
@@ -7,9 +7,14 @@ from sqlalchemy.orm import Session
 from database import get_db_connection, library_engine as engine
 import models
 # Routers defined in other file grouped below in include_router
-from routers import users,books, auth, transactions
+from routers import users,books, auth, transactions, holds
 # used to verify the token.
 from middleware import verify_token
+# in memory indexes every worker keeps in sync with the database in the background
+from utils.periodic import run_periodically
+from utils.search import refresh_book_index, INDEX_REFRESH_SECONDS
+from utils.recommendations import refresh_related_index, RELATED_REFRESH_SECONDS
+from utils.holds import expire_due_holds, HOLD_EXPIRY_INTERVAL_SECONDS
 
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -17,6 +22,8 @@ from fastapi.middleware.cors import CORSMiddleware
 
 # Making database tables using engine created in database.py
 models.Base.metadata.create_all(bind=engine)
+# and add the columns introduced since to tables which already existed
+models.upgrade_schema(engine)
 
 # Initialising the application.
 app = FastAPI(title="TCS - CTO Interactive Hackathon Library",
@@ -47,6 +54,17 @@ app.include_router(auth.router, prefix="/auth", tags=["Authentication"])
 app.include_router(books.router, prefix="/books", tags=["Books"])
 app.include_router(users.router, prefix="/users", tags=["Users"])
 app.include_router(transactions.router, prefix="/transactions", tags=["Transactions"])
+app.include_router(holds.router, prefix="/holds", tags=["Holds"])
+
+
+# Every worker builds its fuzzy search index and "borrowed together" matrix in the background and then
+# keeps them up to date with the writes made through the other workers. Holds whose pickup window has
+# passed are expired and their copy handed on.
+@app.on_event("startup")
+def start_background_jobs():
+    run_periodically("book-index-refresh", INDEX_REFRESH_SECONDS, refresh_book_index)
+    run_periodically("related-books-refresh", RELATED_REFRESH_SECONDS, refresh_related_index)
+    run_periodically("hold-expiry", HOLD_EXPIRY_INTERVAL_SECONDS, expire_due_holds)
 
 
 #base route
@@ -18,12 +18,21 @@ from jose import JWTError, jwt
 from datetime import datetime, timedelta
 # For hashing the password.
 from passlib.context import CryptContext
+# The in memory token generation map is shared by all the request threads
+import threading
+import time
+from sqlalchemy import event
 import models
-from database import get_db_connection
+import schemas
+from database import SessionLocal
+from utils.versions import next_version, VersionWatermark
 
 SECRET_KEY = "FASTAPI_PROJECT"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# How often the token generations are re-read from the database, this is how long a token revoked
+# by another worker process can still be used here
+TOKEN_GENERATION_REFRESH_SECONDS = 5
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -58,10 +67,83 @@ def create_access_token(data:dict, expires_delta: timedelta=None):
     return encoded_jwt
 
 
-# verify the token
+# Token generations
+
+# user id -> current token generation, only users whose generation was ever bumped are in it
+_token_generations = {}
+_token_generations_lock = threading.Lock()
+_token_generations_refreshed_at = None
+_token_generations_watermark = VersionWatermark(TOKEN_GENERATION_REFRESH_SECONDS)
+
+
+# Reads the generations bumped since the last refresh, the whole table the first time
+def _refresh_token_generations():
+    global _token_generations_refreshed_at
+    since = _token_generations_watermark.begin()
+    db = SessionLocal()
+    try:
+        rows = db.query(models.TokenGeneration.user_id, models.TokenGeneration.generation, models.TokenGeneration.version).filter(
+            models.TokenGeneration.version > since
+        ).all()
+    finally:
+        db.close()
+    for user_id, generation, version in rows:
+        # never go back, a bump committed by this process may be newer than what was read
+        if generation > _token_generations.get(user_id, 0):
+            _token_generations[user_id] = generation
+    _token_generations_watermark.end(max((version for user_id, generation, version in rows), default=0))
+    _token_generations_refreshed_at = time.monotonic()
+
+
+def _token_generations_stale():
+    return (_token_generations_refreshed_at is None
+            or time.monotonic() - _token_generations_refreshed_at > TOKEN_GENERATION_REFRESH_SECONDS)
+
+
+# Current token generation of a user, from memory, the database is read at most once per refresh interval
+def get_token_generation(user_id: int):
+    if _token_generations_stale():
+        with _token_generations_lock:
+            if _token_generations_stale():
+                _refresh_token_generations()
+    return _token_generations.get(user_id, 0)
+
+
+# Revokes every token of the user issued so far. The caller commits, once the commit succeeds this
+# process stops accepting the old tokens straight away and the other workers within
+# TOKEN_GENERATION_REFRESH_SECONDS. A rolled back bump changes nothing.
+def bump_token_generation(db: Session, user_id: int):
+    row = db.query(models.TokenGeneration).filter(models.TokenGeneration.user_id == user_id).with_for_update().first()
+    if row is None:
+        row = models.TokenGeneration(user_id=user_id, generation=0)
+        db.add(row)
+    row.generation += 1
+    row.updated_at = datetime.utcnow()
+    row.version = next_version(models.token_generation_version_seq, models.TokenGeneration.version)
+
+    db.info.setdefault("token_generations", {})[user_id] = row.generation
+    return row.generation
+
+
+# Bumps are applied to the in memory map only once they are committed
+@event.listens_for(SessionLocal, "after_commit")
+def _apply_committed_token_generations(session):
+    bumped = session.info.pop("token_generations", None)
+    if bumped:
+        with _token_generations_lock:
+            for user_id, generation in bumped.items():
+                _token_generations[user_id] = max(generation, _token_generations.get(user_id, 0))
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_rolled_back_token_generations(session):
+    session.info.pop("token_generations", None)
 
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session= Depends(get_db_connection)):
+# verify the token
+
+# Authorizes purely from the signed claims, user id, role and token generation, no database lookup per request
+def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail = "Could not validate credentials",
@@ -70,21 +152,24 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security),
 
     try:
         payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
+        user_id = payload.get("uid")
+        role = payload.get("role")
+        generation = payload.get("gen")
+        # tokens issued before the claims were added have no uid, the user has to log in again
+        if user_id is None or role is None or generation is None:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
 
-
-    user = db.query(models.User).filter(models.User.email == email).first()
-
-    if user is None:
+    # a logout, role change or deletion since the token was issued has revoked it. A generation newer
+    # than the one known here is fine, it was bumped by another worker which this one has not read yet.
+    if generation < get_token_generation(user_id):
         raise credentials_exception
-    return user
+
+    return schemas.TokenData(id=user_id, email=payload.get("sub"), role=role, generation=generation)
 
 # Verify the admin user type for protected routes
-def verify_admin(current_user:models.User = Depends(verify_token)):
+def verify_admin(current_user: schemas.TokenData = Depends(verify_token)):
     if(current_user.role != "admin"):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="No admin rights to perform requested action")
     return current_user
@@ -1,5 +1,5 @@
 # Importing SQLAlchemy's core and ORM components to define table structures and relationships
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Index, Sequence, inspect
 from sqlalchemy.orm import relationship
 # Importing base class from database.py to allow table class inheritance
 from database import Base
@@ -21,6 +21,7 @@ class User(Base):
 
     # Relationship to the Transaction table, back_populates ensures bidirectional linkage
     transactions = relationship("Transaction", back_populates="user")
+    holds = relationship("Hold", back_populates="user")
 
 
 # BOOK MODEL
@@ -37,9 +38,17 @@ class Book(Base):
     category = Column(String, nullable=False)
     quantity = Column(Integer, nullable=False, default=1)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Stamped by the database when the book is added or its title / author change (see utils/search.py),
+    # every worker re-indexes only the books above the version it has already read
+    version = Column(Integer, nullable=False, default=0, index=True)
 
     # Relationship to the Transaction table
     transactions = relationship("Transaction", back_populates="book")
+    holds = relationship("Hold", back_populates="book")
+
+
+# Source of Book.version on PostgreSQL, sqlite has no sequences (see utils/versions.py)
+book_version_seq = Sequence("book_version_seq", metadata=Base.metadata)
 
 
 # TRANSACTION MODEL
@@ -59,3 +68,74 @@ class Transaction(Base):
     # Relationships to user and book with bidirectional linkage
     user = relationship("User", back_populates="transactions")
     book = relationship("Book", back_populates="transactions")
+
+
+# HOLD MODEL
+
+# SQLAlchemy model to represent the 'holds' table, the waitlist for books which are out of stock
+class Hold(Base):
+    __tablename__ = "holds"  # Table name in the database
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    book_id = Column(Integer, ForeignKey("books.id"), nullable=False)
+    # waiting -> ready (a returned copy is kept aside) -> fulfilled / expired, or cancelled by the user
+    status = Column(String, nullable=False, default="waiting")
+    created_at = Column(DateTime, default=datetime.utcnow)
+    ready_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True)
+
+    # Relationships to user and book with bidirectional linkage
+    user = relationship("User", back_populates="holds")
+    book = relationship("Book", back_populates="holds")
+
+    __table_args__ = (
+        # The queue of a book, next holder is the oldest waiting hold, found with one index seek
+        Index("ix_holds_book_status_created", "book_id", "status", "created_at"),
+        # Used by the expiry job to find ready holds whose pickup window has passed
+        Index("ix_holds_status_expires", "status", "expires_at"),
+    )
+
+
+# TOKEN GENERATION MODEL
+
+# SQLAlchemy model to represent the 'token_generations' table. Access tokens carry the generation of
+# their user, bumping it (logout, role change, deletion) revokes every token issued before.
+# Users without a row are at generation 0. No foreign key, the row has to outlive a deleted user.
+class TokenGeneration(Base):
+    __tablename__ = "token_generations"  # Table name in the database
+
+    user_id = Column(Integer, primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)
+    # Stamped by the database on every bump, increasing across all the workers, lets every worker pick up
+    # only the generations changed since its last refresh without trusting the clocks of the app hosts
+    version = Column(Integer, nullable=False, default=0, index=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+# Source of TokenGeneration.version on PostgreSQL, sqlite has no sequences (see utils/versions.py)
+token_generation_version_seq = Sequence("token_generation_version_seq", metadata=Base.metadata)
+
+
+# SCHEMA UPGRADES
+
+# Columns added to tables after they were first created, as (table, column, column definition).
+# create_all only creates missing tables, upgrade_schema adds these columns (and their index) to
+# databases created before them, e.g. the library.db shipped with the repo.
+ADDED_COLUMNS = [
+    ("books", "version", "INTEGER NOT NULL DEFAULT 0"),
+    ("token_generations", "version", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+
+def upgrade_schema(engine):
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    with engine.begin() as connection:
+        for table, column, definition in ADDED_COLUMNS:
+            if table not in tables or column in {existing["name"] for existing in inspector.get_columns(table)}:
+                continue
+            # IF NOT EXISTS lets several PostgreSQL workers start at once, sqlite does not support it
+            if_not_exists = "" if engine.dialect.name == "sqlite" else "IF NOT EXISTS "
+            connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {if_not_exists}{column} {definition}")
+            connection.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS ix_{table}_{column} ON {table} ({column})")
@@ -10,7 +10,7 @@ import schemas
 # To connect to the database session
 from database import get_db_connection
 # middleware for authentication as defined in middleware.py file.
-from middleware import verify_password, get_password_hash, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from middleware import verify_password, get_password_hash, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, verify_token, bump_token_generation
 
 # creating an instance of router which will later group the new routes created below.
 router = APIRouter()
@@ -59,11 +59,14 @@ def login(user_credentials: schemas.UserLogin, db: Session = Depends(get_db_conn
     if not user or not verify_password(user_credentials.password, user.password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
+    # Current token generation straight from the database, tokens of older generations are revoked
+    generation = db.query(models.TokenGeneration.generation).filter(models.TokenGeneration.user_id == user.id).scalar() or 0
+
     # timedelta to create a timedelta object for token validity.
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    #  creating the JWT
+    #  creating the JWT, with the claims protected routes are authorized from without a database lookup
     access_token = create_access_token(
-        data={"sub": user.email},
+        data={"sub": user.email, "uid": user.id, "role": user.role, "gen": generation},
         expires_delta=access_token_expires
     )
 
@@ -78,3 +81,11 @@ def login(user_credentials: schemas.UserLogin, db: Session = Depends(get_db_conn
             "role": user.role
         }
     }
+
+
+# logout route, revokes every token of the user issued so far (on every device)
+@router.post("/logout")
+def logout(db: Session = Depends(get_db_connection), current_user: schemas.TokenData = Depends(verify_token)):
+    bump_token_generation(db, current_user.id)
+    db.commit()
+    return {"message": "Logged out successfully"}
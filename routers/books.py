@@ -1,5 +1,7 @@
 # Routing related libraries.
 from fastapi import APIRouter, Depends, HTTPException, status, Query
+# Sparse fieldset responses are returned as is, without the full response model
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 # logical or
 from sqlalchemy import or_
@@ -13,6 +15,14 @@ import schemas
 from database import get_db_connection
 # middleware for authentication as defined in middleware.py file.
 from middleware import verify_token, verify_admin
+# batch lookup and sparse fieldset helpers
+from utils.fields import parse_ids, parse_fields, sparse_rows
+# trigram index for typo tolerant search
+from utils.search import book_index, FUZZY_DEFAULT_THRESHOLD
+# added copies go to the waitlist before the shelf
+from utils.holds import allocate_copy
+# precomputed "borrowed together" neighbours
+from utils.recommendations import related_index, RELATED_TOP_K
 import math
 
 # A router instance
@@ -21,7 +31,7 @@ router = APIRouter()
 # response will be bookresponse type from model.
 @router.post("/",response_model=schemas.BookResponse)
 #  Dependency to connect to the database and will receive request body of type BookCreate
-def add_book(book: schemas.BookCreate, db: Session = Depends(get_db_connection), current_user: models.User = Depends(verify_admin)):
+def add_book(book: schemas.BookCreate, db: Session = Depends(get_db_connection), current_user: schemas.TokenData = Depends(verify_admin)):
     db_book = db.query(models.Book).filter(models.Book.isbn == book.isbn).first()
 
     if db_book:
@@ -31,6 +41,8 @@ def add_book(book: schemas.BookCreate, db: Session = Depends(get_db_connection),
     db.add(db_book)
     db.commit()
     db.refresh(db_book)
+    # indexed here straight away, the other workers pick it up on their next refresh
+    book_index.add(db_book.id, db_book.title, db_book.author, db_book.version)
 
     return db_book
 
@@ -44,11 +56,21 @@ def list_books(
     isbn: Optional[str] = Query(None),
     category: Optional[str] = Query(None),
     published_year: Optional[int] = Query(None),
+    ids: Optional[str] = Query(None, description="Comma separated book ids to fetch in one request"),
+    fields: Optional[str] = Query(None, description="Comma separated columns to return, e.g. id,title,author"),
     db: Session = Depends(get_db_connection)
     ):
 
+    book_ids = parse_ids(ids)
+    columns = parse_fields(fields, models.Book, schemas.BookResponse)
+
     query = db.query(models.Book)
 
+# Batch lookup, one IN query for all the ids and everything found comes back in a single page
+    if book_ids is not None:
+        query = query.filter(models.Book.id.in_(book_ids))
+        page, per_page = 1, max(len(book_ids), 1)
+
 #  Filter based on query made after fetching all the books.
     if title:
         query = query.filter(models.Book.title.contains(title))
@@ -65,25 +87,89 @@ def list_books(
 #  simple math logic for pagination, remainder factor theorem
     total_books = query.count()
     total_pages = math.ceil(total_books / per_page)
+    query = query.offset((page - 1) * per_page).limit(per_page)
+
+# Only the asked columns are selected, rows are not hydrated into Book objects
+    if columns:
+        books = sparse_rows(query.with_entities(*columns).all())
+        return JSONResponse({"books": books, "total": total_books, "total_pages": total_pages, "per_page": per_page, "page": page})
+
 # have to do .all() to receive the result as list
-    books = query.offset((page - 1) * per_page).limit(per_page).all()
+    books = query.all()
 
     return {"books": books, "total": total_books, "total_pages": total_pages, "per_page": per_page, "page": page}
 
 
 #  Search based on specific requirement
 @router.get("/search", response_model=List[schemas.BookResponse])
-def search_books( q: str = Query(..., description="Search Keywrod for query"), db: Session = Depends(get_db_connection)):
+def search_books(
+    q: str = Query(..., description="Search Keywrod for query"),
+    fuzzy: bool = Query(False, description="Typo tolerant search over title and author, best matches first"),
+    threshold: float = Query(FUZZY_DEFAULT_THRESHOLD, ge=0.0, le=1.0, description="Minimum similarity for fuzzy matches"),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db_connection)
+    ):
+
+    if fuzzy:
+        # the index is built in the background when the worker starts, not inside a request
+        if not book_index.loaded:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Search index is still loading, try again shortly",
+                headers={"Retry-After": "5"}
+            )
+        ranked_ids = [book_id for book_id, similarity in book_index.search(q, threshold, limit)]
+        # one IN query for the matches, then put them back in ranked order
+        books_by_id = {book.id: book for book in db.query(models.Book).filter(models.Book.id.in_(ranked_ids)).all()}
+        return [books_by_id[book_id] for book_id in ranked_ids if book_id in books_by_id]
 
     books = db.query(models.Book).filter(or_(
         models.Book.title.contains(q),
         models.Book.author.contains(q),
         models.Book.isbn.contains(q),
-    )).limit(20).all()
+    )).limit(limit).all()
 
     return books
 
 
+#  Books most often borrowed by the same users as this one, best first
+@router.get("/{book_id}/related", response_model=List[schemas.BookResponse])
+def get_related_books(
+    book_id: int,
+    limit: int = Query(10, ge=1, le=RELATED_TOP_K),
+    db: Session = Depends(get_db_connection)
+):
+    book = db.query(models.Book).filter(models.Book.id == book_id).first()
+    if not book:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Book not found"
+        )
+
+    # the matrix is computed in the background when the worker starts, not inside a request
+    if not related_index.loaded:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Recommendations are still loading, try again shortly",
+            headers={"Retry-After": "5"}
+        )
+    related_ids = related_index.related(book_id, limit)
+    # one IN query for the neighbours, then put them back in ranked order
+    books_by_id = {book.id: book for book in db.query(models.Book).filter(models.Book.id.in_(related_ids)).all()}
+    return [books_by_id[related_id] for related_id in related_ids if related_id in books_by_id]
+
+
+#  Admin route to recompute the co-borrow matrix of the worker serving it from the whole circulation history
+#  right away. Every worker already does this on its own every RELATED_REBUILD_SECONDS.
+@router.post("/related/rebuild")
+def rebuild_related_books(
+    db: Session = Depends(get_db_connection),
+    current_user: schemas.TokenData = Depends(verify_admin)
+):
+    related_index.build(db)
+    return {"message": "Related books rebuilt successfully"}
+
+
 #  Update request which will receive  book id and book update in BookUpdate schema.
 # response willbe of updated books.
 @router.put("/{book_id}", response_model=schemas.BookResponse)
@@ -91,9 +177,10 @@ def update_book(
     book_id: int,
     book_update: schemas.BookUpdate,
     db: Session = Depends(get_db_connection),
-    current_user: models.User = Depends(verify_admin)
+    current_user: schemas.TokenData = Depends(verify_admin)
 ):
-    book = db.query(models.Book).filter(models.Book.id == book_id).first()
+    # locked like in checkout and return, the quantity is read and changed below
+    book = db.query(models.Book).filter(models.Book.id == book_id).with_for_update().first()
     if not book:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -101,12 +188,22 @@ def update_book(
         )
 # To avoid over-writing the fields with None / null values we use exclude unset = true
     update_data = book_update.dict(exclude_unset=True)
+    added_copies = 0
+    if update_data.get("quantity") is not None:
+        added_copies = update_data.pop("quantity") - book.quantity
+        if added_copies < 0:
+            book.quantity += added_copies
     for field, value in update_data.items():
         # setattr(object, attribute_name, value) book is the object, and filed value as key val pairs
         setattr(book, field, value) # helped to avoid hard-coding values.
+    # New copies go to the waitlist first, one per waiting holder, the rest goes on the shelf
+    for _ in range(added_copies):
+        allocate_copy(db, book)
 
     db.commit()
     db.refresh(book)
+    if "title" in update_data or "author" in update_data:
+        book_index.add(book.id, book.title, book.author, book.version)
     return book
 
 #  Deletion route for book deleting through the book id as path parameter accessible only to admin.
@@ -114,7 +211,7 @@ def update_book(
 def delete_book(
     book_id: int,
     db: Session = Depends(get_db_connection),
-    current_user: models.User = Depends(verify_admin)
+    current_user: schemas.TokenData = Depends(verify_admin)
 ):
     book = db.query(models.Book).filter(models.Book.id == book_id).first()
     if not book:
@@ -125,4 +222,5 @@ def delete_book(
 
     db.delete(book)
     db.commit()
+    book_index.remove(book_id)
     return {"message": "Book deleted successfully"}
\ No newline at end of file
@@ -0,0 +1,136 @@
+# Required FastAPI imports for routing and error handling
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+# Session management for DB transactions
+from sqlalchemy.orm import Session
+# Type hinting for returning multiple results
+from typing import List
+# ORM Models defined in models.py
+import models
+# Pydantic schemas for validation
+import schemas
+# DB session injector
+from database import get_db_connection
+# Middleware for authentication and admin access
+from middleware import verify_token, verify_admin
+# Waitlist helpers shared with the transactions router
+from utils.holds import allocate_copy, expire_holds, ACTIVE_HOLD_STATUSES, HOLD_EXPIRY_BATCH_SIZE
+
+# Create a new router instance for hold / waitlist routes
+router = APIRouter()
+
+# Route to join the waitlist of a book which is out of stock
+@router.post("/", response_model=schemas.HoldResponse)
+def place_hold(
+    hold: schemas.HoldCreate,
+    db: Session = Depends(get_db_connection),
+    current_user: schemas.TokenData = Depends(verify_token)
+):
+    book = db.query(models.Book).filter(models.Book.id == hold.book_id).first()
+    if not book:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Book not found"
+        )
+
+    # Holds are only for books which cannot be checked out right now
+    if book.quantity > 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Book is available, check it out directly"
+        )
+
+    # One place in the queue per user and book
+    existing_hold = db.query(models.Hold).filter(
+        models.Hold.user_id == current_user.id,
+        models.Hold.book_id == hold.book_id,
+        models.Hold.status.in_(ACTIVE_HOLD_STATUSES)
+    ).first()
+
+    if existing_hold:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="You already have a hold on this book"
+        )
+
+    # No point waiting for a book the user already has
+    existing_transaction = db.query(models.Transaction).filter(
+        models.Transaction.user_id == current_user.id,
+        models.Transaction.book_id == hold.book_id,
+        models.Transaction.is_returned == False
+    ).first()
+
+    if existing_transaction:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="You already have this book checked out"
+        )
+
+    db_hold = models.Hold(
+        user_id=current_user.id,
+        book_id=hold.book_id,
+        status="waiting"
+    )
+    db.add(db_hold)
+    db.commit()
+    db.refresh(db_hold)
+
+    return db_hold
+
+# Route to get the waiting and ready holds of the logged in user
+@router.get("/my-holds", response_model=List[schemas.HoldResponse])
+def get_my_holds(
+    db: Session = Depends(get_db_connection),
+    current_user: schemas.TokenData = Depends(verify_token)
+):
+    holds = db.query(models.Hold).filter(
+        models.Hold.user_id == current_user.id,
+        models.Hold.status.in_(ACTIVE_HOLD_STATUSES)
+    ).order_by(models.Hold.created_at).all()
+
+    return holds
+
+# Route to leave the waitlist, a copy kept aside for this hold goes to the next holder
+@router.delete("/{hold_id}")
+def cancel_hold(
+    hold_id: int,
+    db: Session = Depends(get_db_connection),
+    current_user: schemas.TokenData = Depends(verify_token)
+):
+    book_id = db.query(models.Hold.book_id).filter(
+        models.Hold.id == hold_id,
+        models.Hold.user_id == current_user.id
+    ).scalar()
+
+    # Lock book first and then the hold, same order as checkout and return. The hold is read again under
+    # the lock (and refreshed in the session) as a checkout or the expiry job may have changed it since.
+    book = db.query(models.Book).filter(models.Book.id == book_id).with_for_update().first() if book_id else None
+    hold = db.query(models.Hold).filter(
+        models.Hold.id == hold_id,
+        models.Hold.user_id == current_user.id,
+        models.Hold.status.in_(ACTIVE_HOLD_STATUSES)
+    ).populate_existing().with_for_update().first()
+
+    if not hold:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Hold not found"
+        )
+
+    # Only a ready hold has a copy kept aside, it goes to the next holder
+    if hold.status == "ready" and book:
+        allocate_copy(db, book)
+
+    hold.status = "cancelled"
+    db.commit()
+    return {"message": "Hold cancelled successfully"}
+
+# Admin route to expire holds whose pickup window has passed now, the background job in main.py does it every minute
+@router.post("/expire")
+def expire_ready_holds(
+    batch_size: int = Query(HOLD_EXPIRY_BATCH_SIZE, ge=1, le=1000),
+    db: Session = Depends(get_db_connection),
+    current_user: schemas.TokenData = Depends(verify_admin)
+):
+    expired = expire_holds(db, batch_size)
+    db.commit()
+    return {"expired": expired}
@@ -1,11 +1,13 @@
 # Required FastAPI imports for routing and error handling
-from fastapi import APIRouter, Depends, HTTPException, status
-# Session management for DB transactions
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+# Sparse fieldset responses are returned as is, without the full response model
+from fastapi.responses import JSONResponse
+# Session management for DB transactions, selectinload fetches the books of a list in one extra query
+from sqlalchemy.orm import Session, selectinload
 # To track current and due dates for transactions
-from datetime import datetime
+from datetime import datetime, timezone
 # Type hinting for returning multiple results
-from typing import List
+from typing import List, Optional
 # ORM Models defined in models.py
 import models
 # Pydantic schemas for validation
@@ -14,6 +16,17 @@ import schemas
 from database import get_db_connection
 # Middleware for authentication and admin access
 from middleware import verify_token, verify_admin
+# Waitlist helpers, a returned copy goes to the next holder
+from utils.holds import allocate_copy
+# sparse fieldset helpers
+from utils.fields import parse_fields, sparse_rows
+# "borrowed together" recommendations learn from every new loan
+from utils.recommendations import related_index
+# checkout / return commit either directly or batched by the group commit writer
+from utils.group_commit import run_write
+# vectorized overdue / fine report
+from utils.overdue import cached_overdue_report
+import math
 
 # Create a new router instance for transaction-related routes
 router = APIRouter()
@@ -23,26 +36,43 @@ router = APIRouter()
 def checkout_book(
     transaction: schemas.TransactionCreate,
     db: Session = Depends(get_db_connection),
-    current_user: models.User = Depends(verify_token)
+    current_user: schemas.TokenData = Depends(verify_token)
 ):
-    # Fetch the book from the database
-    book = db.query(models.Book).filter(models.Book.id == transaction.book_id).first()
+    user_id = current_user.id
+    result = run_write(db, lambda session: _checkout(session, user_id, transaction))
+    related_index.record_loan(user_id, transaction.book_id)
+    return result
+
+# The checkout itself, run by run_write which commits it. Returns the response already serialized
+# so it can be handed back after the session is closed.
+def _checkout(db: Session, user_id: int, transaction: schemas.TransactionCreate):
+    # Fetch the book from the database and lock its row (SELECT ... FOR UPDATE on PostgreSQL, ignored on sqlite)
+    # so concurrent checkouts of the same title wait here, while other titles are not blocked.
+    book = db.query(models.Book).filter(models.Book.id == transaction.book_id).with_for_update().first()
     if not book:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Book not found"
         )
 
+    # A copy kept aside for this user by the waitlist, valid until its pickup window ends
+    ready_hold = db.query(models.Hold).filter(
+        models.Hold.user_id == user_id,
+        models.Hold.book_id == transaction.book_id,
+        models.Hold.status == "ready",
+        models.Hold.expires_at >= datetime.utcnow()
+    ).with_for_update().first()
+
     # If book is not available
-    if book.quantity <= 0:
+    if book.quantity <= 0 and not ready_hold:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Book not available"
+            detail="Book not available, place a hold to join the waitlist"
         )
 
     # Check if the user already has this book and hasn't returned
     existing_transaction = db.query(models.Transaction).filter(
-        models.Transaction.user_id == current_user.id,
+        models.Transaction.user_id == user_id,
         models.Transaction.book_id == transaction.book_id,
         models.Transaction.is_returned == False
     ).first()
@@ -55,38 +85,56 @@ def checkout_book(
 
     # If everything is valid, create a new transaction entry
     db_transaction = models.Transaction(
-        user_id=current_user.id,
+        user_id=user_id,
         book_id=transaction.book_id,
         due_date=transaction.due_date,
         checkout_date=datetime.utcnow(),
         is_returned=False
     )
 
-    # Reduce the book quantity as one book is being issued
-    book.quantity -= 1
+    # Reduce the book quantity as one book is being issued, reserved copies were never added back to it
+    if ready_hold:
+        ready_hold.status = "fulfilled"
+    else:
+        book.quantity -= 1
+        # A copy was on the shelf (e.g. added by an admin) while the user was still queued, the hold is
+        # served by this checkout so no returned copy is kept aside for them later
+        db.query(models.Hold).filter(
+            models.Hold.user_id == user_id,
+            models.Hold.book_id == transaction.book_id,
+            models.Hold.status == "waiting"
+        ).update({models.Hold.status: "fulfilled"}, synchronize_session=False)
 
     db.add(db_transaction)
-    db.commit()
-    db.refresh(db_transaction)
+    # flush to get the id of the new transaction
+    db.flush()
 
     # Attach book details to the transaction response
     db_transaction.book = book
 
-    return db_transaction
+    return schemas.TransactionResponse.model_validate(db_transaction)
 
 # Route to return a borrowed book
 @router.post("/return", response_model=schemas.TransactionResponse)
 def return_book_by_book_id(
     data: schemas.BookReturnById,
     db: Session = Depends(get_db_connection),
-    current_user: models.User = Depends(verify_token)
+    current_user: schemas.TokenData = Depends(verify_token)
 ):
-    # Find the unreturned transaction for this user and book
+    user_id = current_user.id
+    return run_write(db, lambda session: _return_book(session, user_id, data))
+
+# The return itself, run by run_write which commits it
+def _return_book(db: Session, user_id: int, data: schemas.BookReturnById):
+    # Lock the book row first, same order as checkout so the two paths can never deadlock each other
+    book = db.query(models.Book).filter(models.Book.id == data.book_id).with_for_update().first()
+
+    # Find the unreturned transaction for this user and book, locked so it cannot be returned twice
     transaction = db.query(models.Transaction).filter(
-        models.Transaction.user_id == current_user.id,
+        models.Transaction.user_id == user_id,
         models.Transaction.book_id == data.book_id,
         models.Transaction.is_returned == False
-    ).first()
+    ).with_for_update().first()
 
     # If no active transaction found
     if not transaction:
@@ -99,24 +147,22 @@ def return_book_by_book_id(
     transaction.is_returned = True
     transaction.return_date = datetime.utcnow()
 
-    # Increment the book quantity in DB
-    book = db.query(models.Book).filter(models.Book.id == data.book_id).first()
+    # Give the copy to the next holder in the waitlist, otherwise increment the book quantity in DB
     if book:
-        book.quantity += 1
+        allocate_copy(db, book)
 
-    db.commit()
-    db.refresh(transaction)
+    db.flush()
     transaction.book = book
 
-    return transaction
+    return schemas.TransactionResponse.model_validate(transaction)
 
 # Route to get all books currently borrowed by the user
 @router.get("/my-books", response_model=List[schemas.TransactionResponse])
 def get_my_borrowed_books(
     db: Session = Depends(get_db_connection),
-    current_user: models.User = Depends(verify_token)
+    current_user: schemas.TokenData = Depends(verify_token)
 ):
-    transactions = db.query(models.Transaction).filter(
+    transactions = db.query(models.Transaction).options(selectinload(models.Transaction.book)).filter(
         models.Transaction.user_id == current_user.id,
         models.Transaction.is_returned == False
     ).all()
@@ -127,22 +173,86 @@ def get_my_borrowed_books(
 @router.get("/overdue", response_model=List[schemas.TransactionResponse])
 def get_overdue_books(
     db: Session = Depends(get_db_connection),
-    current_user: models.User = Depends(verify_admin)
+    current_user: schemas.TokenData = Depends(verify_admin)
 ):
     current_time = datetime.utcnow()
     # Get all overdue unreturned transactions
-    overdue_transactions = db.query(models.Transaction).filter(
+    overdue_transactions = db.query(models.Transaction).options(selectinload(models.Transaction.book)).filter(
         models.Transaction.due_date < current_time,
         models.Transaction.is_returned == False
     ).all()
 
     return overdue_transactions
 
+# Admin report of overdue books and fines per user, highest fine first, paginated.
+# Pass the generated_at of the first page back as as_of to get the other pages of the same report.
+@router.post("/overdue/report", response_model=schemas.OverdueReport)
+def get_overdue_report(
+    rules: Optional[schemas.FineRules] = None,
+    as_of: Optional[datetime] = Query(None, description="Time the report is computed at (UTC), defaults to now"),
+    page: int = Query(1, ge=1),
+    per_page: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db_connection),
+    current_user: schemas.TokenData = Depends(verify_admin)
+):
+    now = datetime.utcnow()
+    if as_of is None:
+        generated_at = now
+    else:
+        # datetimes are stored as naive UTC
+        generated_at = as_of.astimezone(timezone.utc).replace(tzinfo=None) if as_of.tzinfo else as_of
+        if generated_at > now:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="as_of cannot be in the future"
+            )
+    report = cached_overdue_report(db, rules or schemas.FineRules(), generated_at)
+
+    total_users = len(report["user_id"])
+    start = (page - 1) * per_page
+    page_rows = {column: values[start:start + per_page] for column, values in report.items()}
+
+    # names and emails only for the users of this page, in one IN query
+    page_user_ids = page_rows["user_id"].tolist()
+    users = {
+        user.id: user for user in db.query(models.User.id, models.User.name, models.User.email).filter(
+            models.User.id.in_(page_user_ids)
+        ).all()
+    }
+
+    return {
+        "users": [
+            {
+                "user_id": user_id,
+                "name": users[user_id].name if user_id in users else None,
+                "email": users[user_id].email if user_id in users else None,
+                "overdue_books": int(page_rows["overdue_books"][i]),
+                "days_overdue": int(page_rows["days_overdue"][i]),
+                "fine": float(page_rows["fine"][i]),
+                "oldest_due_date": page_rows["oldest_due_date"][i].item(),
+            }
+            for i, user_id in enumerate(page_user_ids)
+        ],
+        "total_users": total_users,
+        "total_overdue_books": int(report["overdue_books"].sum()),
+        "total_fine": round(float(report["fine"].sum()), 2),
+        "generated_at": generated_at,
+        "page": page,
+        "per_page": per_page,
+        "total_pages": math.ceil(total_users / per_page),
+    }
+
 # Admin route to fetch all transactions from the database table
 @router.get("/", response_model=List[schemas.TransactionResponse])
 def get_all_transactions(
+    fields: Optional[str] = Query(None, description="Comma separated columns to return, e.g. id,book_id,due_date"),
     db: Session = Depends(get_db_connection),
-    current_user: models.User = Depends(verify_admin)
+    current_user: schemas.TokenData = Depends(verify_admin)
 ):
-    transactions = db.query(models.Transaction).all()
+    columns = parse_fields(fields, models.Transaction, schemas.TransactionResponse)
+    # Only the asked columns are selected, the nested book is left out
+    if columns:
+        return JSONResponse(sparse_rows(db.query(*columns).all()))
+
+    transactions = db.query(models.Transaction).options(selectinload(models.Transaction.book)).all()
     return transactions
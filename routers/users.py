@@ -1,9 +1,11 @@
 # Routing related libraries
-from fastapi import APIRouter, Depends, HTTPException, status
-# ORM class to maintain session with the database
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+# Sparse fieldset responses are returned as is, without the full response model
+from fastapi.responses import JSONResponse
+# ORM class to maintain session with the database, defer skips loading a column
+from sqlalchemy.orm import Session, defer
 # For type hinting list of users
-from typing import List
+from typing import List, Optional
 # Table structures for SQLAlchemy ORM
 import models
 # Pydantic schemas for validation and serialization
@@ -11,25 +13,50 @@ import schemas
 # DB connection dependency
 from database import get_db_connection
 # Auth and role-based middleware
-from middleware import verify_token, verify_admin, get_password_hash
+from middleware import verify_token, verify_admin, get_password_hash, bump_token_generation
+# batch lookup and sparse fieldset helpers
+from utils.fields import parse_ids, parse_fields, sparse_rows
 
 # Create a new API Router instance to register all user-related routes
 router = APIRouter()
 
 # Route to get currently logged-in user details
 @router.get("/me", response_model=schemas.UserResponse)
-def get_current_user(current_user: models.User = Depends(verify_token)):
-    # verify_token will auto-authenticate and return the current user from token
-    return current_user
+def get_current_user(
+    db: Session = Depends(get_db_connection),
+    current_user: schemas.TokenData = Depends(verify_token)
+):
+    # verify_token authenticates from the token claims, the full profile is read here
+    user = db.query(models.User).options(defer(models.User.password)).filter(models.User.id == current_user.id).first()
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    return user
 
 # Route to get all users (Admin only)
 @router.get("/", response_model=List[schemas.UserResponse])
 def list_users(
+    ids: Optional[str] = Query(None, description="Comma separated user ids to fetch in one request"),
+    fields: Optional[str] = Query(None, description="Comma separated columns to return, e.g. id,name"),
     db: Session = Depends(get_db_connection),
-    current_user: models.User = Depends(verify_admin)
+    current_user: schemas.TokenData = Depends(verify_admin)
 ):
-    # Query to fetch all users from User table
-    users = db.query(models.User).all()
+    user_ids = parse_ids(ids)
+    columns = parse_fields(fields, models.User, schemas.UserResponse)
+
+    # Query to fetch all users from User table, password hash is never sent so it is not loaded
+    query = db.query(models.User).options(defer(models.User.password))
+    # Batch lookup with a single IN query
+    if user_ids is not None:
+        query = query.filter(models.User.id.in_(user_ids))
+
+    # Only the asked columns are selected, rows are not hydrated into User objects
+    if columns:
+        return JSONResponse(sparse_rows(query.with_entities(*columns).all()))
+
+    users = query.all()
     return users
 
 # Route to get a specific user by ID (Admin only)
@@ -37,10 +64,10 @@ def list_users(
 def get_user(
     user_id: int,
     db: Session = Depends(get_db_connection),
-    current_user: models.User = Depends(verify_admin)
+    current_user: schemas.TokenData = Depends(verify_admin)
 ):
     # Fetch user with given ID
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    user = db.query(models.User).options(defer(models.User.password)).filter(models.User.id == user_id).first()
     # Raise error if user not found
     if not user:
         raise HTTPException(
@@ -55,7 +82,7 @@ def update_user(
     user_id: int,
     user_update: schemas.UserUpdate,
     db: Session = Depends(get_db_connection),
-    current_user: models.User = Depends(verify_admin)
+    current_user: schemas.TokenData = Depends(verify_admin)
 ):
     # Fetch existing user
     user = db.query(models.User).filter(models.User.id == user_id).first()
@@ -67,6 +94,9 @@ def update_user(
 
     # Convert Pydantic object to dictionary and update non-null fields
     update_data = user_update.dict(exclude_unset=True)
+    # The role is a claim of the user's tokens, a new role needs a new token
+    if "role" in update_data and update_data["role"] != user.role:
+        bump_token_generation(db, user.id)
     for field, value in update_data.items():
         setattr(user, field, value)
 
@@ -79,7 +109,7 @@ def update_user(
 def delete_user(
     user_id: int,
     db: Session = Depends(get_db_connection),
-    current_user: models.User = Depends(verify_admin)
+    current_user: schemas.TokenData = Depends(verify_admin)
 ):
     # Find user in the database
     user = db.query(models.User).filter(models.User.id == user_id).first()
@@ -90,5 +120,7 @@ def delete_user(
         )
 
     db.delete(user)
+    # Tokens of a deleted user must stop working straight away
+    bump_token_generation(db, user_id)
     db.commit()
     return {"message": "User deleted successfully"}
@@ -1,7 +1,7 @@
 # Importing required types and base classes for data validation and serialization
 from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Dict
 
 # USER SCHEMAS
 
@@ -25,7 +25,7 @@ class UserResponse(BaseModel):
     name: str
     email: EmailStr
     role: str
-    password: str = Field(exclude=True)  # Prevents password from showing in responses
+    # password is deliberately not part of the response, so it does not even have to be loaded
 
     # To avoid error - TypeError: Object of type Book is not JSON serializable
     # We need to convert it to orm sql object.
@@ -94,10 +94,61 @@ class TransactionResponse(BaseModel):
 
 
 
+# OVERDUE REPORT SCHEMAS
+
+# Rules used to calculate fines on overdue books
+class FineRules(BaseModel):
+    daily_rate: float = Field(1.0, ge=0)  # fine per day overdue for categories without their own rate
+    category_rates: Dict[str, float] = {}  # fine per day overdue for specific book categories
+    grace_days: int = Field(0, ge=0)  # days after the due date which are not charged
+    max_fine_per_loan: Optional[float] = Field(None, ge=0)
+    max_fine_per_user: Optional[float] = Field(None, ge=0)
+
+# Overdue books and fine of one user
+class OverdueUserFine(BaseModel):
+    user_id: int
+    name: Optional[str] = None
+    email: Optional[str] = None
+    overdue_books: int
+    days_overdue: int
+    fine: float
+    oldest_due_date: datetime
+
+# Paginated overdue report, per user with the totals of everyone
+class OverdueReport(BaseModel):
+    users: List[OverdueUserFine]
+    total_users: int
+    total_overdue_books: int
+    total_fine: float
+    generated_at: datetime
+    page: int
+    per_page: int
+    total_pages: int
+
 # Schema to return a book using only book ID
 class BookReturnById(BaseModel):
     book_id: int
 
+# HOLD SCHEMAS
+
+# Schema to receive the book a user wants to join the waitlist for
+class HoldCreate(BaseModel):
+    book_id: int
+
+# Schema to return hold data in API responses
+class HoldResponse(BaseModel):
+    id: int
+    user_id: int
+    book_id: int
+    status: str
+    created_at: datetime
+    ready_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+    book: BookResponse
+
+    class Config:
+        from_attributes = True
+
 # AUTH / TOKEN SCHEMAS
 
 # Schema to represent a user's data in response without password
@@ -116,9 +167,12 @@ class TokenWithUser(BaseModel):
     token_type: str
     user: UserOut
 
-# Schema used internally for extracting token data
+# Schema used internally for extracting token data, the verified claims of an access token
 class TokenData(BaseModel):
+    id: int
     email: Optional[str] = None
+    role: str
+    generation: int = 0
 
 # PAGINATION SCHEMA
 
@@ -0,0 +1,58 @@
+# The suite runs on a throwaway sqlite file by default. Point DATABASE_URL at an empty PostgreSQL database
+# to run it there instead, every table in it is dropped and created again for each test:
+#   DATABASE_URL=postgresql+psycopg2://postgres@localhost:5432/library_test python -m pytest
+import os
+import sys
+import tempfile
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import middleware
+import models
+from database import library_engine
+from utils.recommendations import related_index
+from utils.search import book_index
+from utils.versions import VersionWatermark
+
+
+@pytest.fixture
+def client():
+    models.Base.metadata.drop_all(bind=library_engine)
+    models.Base.metadata.create_all(bind=library_engine)
+    # the ids and versions start over with the tables, so does the token generation cache
+    middleware._token_generations.clear()
+    middleware._token_generations_refreshed_at = None
+    middleware._token_generations_watermark = VersionWatermark(middleware.TOKEN_GENERATION_REFRESH_SECONDS)
+    # the routers hold on to the shared indexes, they are emptied in place. Tests which need them loaded
+    # run the background jobs themselves, refresh_book_index() / refresh_related_index().
+    book_index.__init__()
+    related_index.__init__()
+    # not entered as a context manager, so the background jobs of main.py are not started
+    return TestClient(main.app)
+
+
+# Registers a user and returns the Authorization header of a fresh token
+def login(client, email, role="user"):
+    client.post("/auth/register", json={"email": email, "password": "secret", "name": email, "role": role})
+    response = client.post("/auth/login", json={"email": email, "password": "secret"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture
+def admin(client):
+    return login(client, "admin@example.com", role="admin")
+
+
+# Adds a book through the API and returns its id
+def add_book(client, admin, isbn, quantity=1):
+    response = client.post("/books/", json={
+        "title": f"Book {isbn}", "author": "Author", "isbn": isbn,
+        "published_year": 2000, "category": "fiction", "quantity": quantity
+    }, headers=admin)
+    return response.json()["id"]
@@ -0,0 +1,89 @@
+from datetime import timedelta
+
+import middleware
+import models
+from conftest import login
+from database import SessionLocal
+
+
+def user_id(client, headers):
+    return client.get("/users/me", headers=headers).json()["id"]
+
+
+def test_token_is_rejected_after_logout(client):
+    alice = login(client, "alice@example.com")
+    assert client.get("/users/me", headers=alice).status_code == 200
+
+    assert client.post("/auth/logout", headers=alice).status_code == 200
+    assert client.get("/users/me", headers=alice).status_code == 401
+    # a new login gets a token of the new generation
+    assert client.get("/users/me", headers=login(client, "alice@example.com")).status_code == 200
+
+
+def test_token_is_rejected_after_a_role_change(client, admin):
+    alice = login(client, "alice@example.com")
+    alice_id = user_id(client, alice)
+
+    # same role, the token stays valid
+    client.put(f"/users/{alice_id}", json={"role": "user"}, headers=admin)
+    assert client.get("/users/me", headers=alice).status_code == 200
+
+    client.put(f"/users/{alice_id}", json={"role": "admin"}, headers=admin)
+    assert client.get("/users/me", headers=alice).status_code == 401
+    # the new token carries the new role
+    assert client.get("/users/", headers=login(client, "alice@example.com")).status_code == 200
+
+
+def test_token_is_rejected_after_the_user_is_deleted(client, admin):
+    alice = login(client, "alice@example.com")
+
+    assert client.delete(f"/users/{user_id(client, alice)}", headers=admin).status_code == 200
+    assert client.get("/users/me", headers=alice).status_code == 401
+
+
+def test_token_without_the_user_claims_is_rejected(client):
+    login(client, "alice@example.com")
+    # issued before the uid, role and gen claims were added
+    legacy = middleware.create_access_token({"sub": "alice@example.com"}, timedelta(minutes=5))
+    assert client.get("/users/me", headers={"Authorization": f"Bearer {legacy}"}).status_code == 401
+
+
+def test_admin_route_refuses_a_user_token(client, admin):
+    alice = login(client, "alice@example.com")
+    assert client.get("/users/", headers=alice).status_code == 403
+    assert client.get("/users/", headers=admin).status_code == 200
+
+
+def test_rolled_back_bump_changes_nothing(client):
+    alice = login(client, "alice@example.com")
+    alice_id = user_id(client, alice)
+    before = dict(middleware._token_generations)
+
+    db = SessionLocal()
+    middleware.bump_token_generation(db, alice_id)
+    db.rollback()
+    db.close()
+
+    assert middleware._token_generations == before
+    # nothing was written either, a refresh does not revoke the token
+    middleware._token_generations_refreshed_at = None
+    assert client.get("/users/me", headers=alice).status_code == 200
+
+
+def test_bump_by_another_worker_is_picked_up_on_refresh(client):
+    alice = login(client, "alice@example.com")
+    alice_id = user_id(client, alice)
+
+    # committed by another process, this one's after_commit listener does not see it
+    db = SessionLocal()
+    db.add(models.TokenGeneration(
+        user_id=alice_id, generation=1,
+        version=middleware.next_version(models.token_generation_version_seq, models.TokenGeneration.version)
+    ))
+    db.commit()
+    db.close()
+    assert client.get("/users/me", headers=alice).status_code == 200
+
+    # the next refresh interval
+    middleware._token_generations_refreshed_at = None
+    assert client.get("/users/me", headers=alice).status_code == 401
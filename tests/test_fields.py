@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+
+from conftest import login, add_book
+from utils.fields import MAX_BATCH_IDS
+
+DUE_DATE = (datetime.utcnow() + timedelta(days=14)).isoformat()
+
+
+def test_hidden_columns_cannot_be_asked_for(client, admin):
+    response = client.get("/users/?fields=id,password", headers=admin)
+    assert response.status_code == 400
+    assert "password" in response.json()["detail"]
+    # nor columns which do not exist
+    assert client.get("/books/?fields=title,shelf", headers=admin).status_code == 400
+
+
+def test_books_by_ids(client, admin):
+    first, second, third = (add_book(client, admin, isbn) for isbn in ("isbn-1", "isbn-2", "isbn-3"))
+
+    response = client.get(f"/books/?ids={third},{first},{first}")
+    assert response.status_code == 200
+    assert sorted(book["id"] for book in response.json()["books"]) == [first, third]
+    assert response.json()["total"] == 2
+    # only the asked columns, plus the id
+    books = client.get(f"/books/?ids={second}&fields=title").json()["books"]
+    assert books == [{"id": second, "title": "Book isbn-2"}]
+
+
+def test_users_by_ids(client, admin):
+    alice_id = client.get("/users/me", headers=login(client, "alice@example.com")).json()["id"]
+    login(client, "bob@example.com")
+
+    users = client.get(f"/users/?ids={alice_id}", headers=admin).json()
+    assert [user["email"] for user in users] == ["alice@example.com"]
+    users = client.get(f"/users/?ids={alice_id}&fields=email", headers=admin).json()
+    assert users == [{"id": alice_id, "email": "alice@example.com"}]
+
+
+def test_bad_ids_are_rejected(client, admin):
+    assert client.get("/books/?ids=1,two").status_code == 400
+    assert client.get("/users/?ids=1.5", headers=admin).status_code == 400
+
+    too_many = ",".join(str(i) for i in range(1, MAX_BATCH_IDS + 2))
+    assert client.get(f"/books/?ids={too_many}").status_code == 400
+    assert client.get(f"/users/?ids={too_many}", headers=admin).status_code == 400
+    at_most = ",".join(str(i) for i in range(1, MAX_BATCH_IDS + 1))
+    assert client.get(f"/books/?ids={at_most}").status_code == 200
+
+
+def test_transaction_fields(client, admin):
+    book_id = add_book(client, admin, "isbn-1")
+    alice = login(client, "alice@example.com")
+    client.post("/transactions/checkout", json={"book_id": book_id, "due_date": DUE_DATE}, headers=alice)
+
+    transactions = client.get("/transactions/?fields=book_id,is_returned", headers=admin).json()
+    assert [set(transaction) for transaction in transactions] == [{"id", "book_id", "is_returned"}]
+    assert transactions[0]["book_id"] == book_id
+    assert transactions[0]["is_returned"] is False
+    # the nested book is not a column
+    assert client.get("/transactions/?fields=book", headers=admin).status_code == 400
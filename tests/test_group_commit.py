@@ -0,0 +1,42 @@
+import threading
+from concurrent.futures import TimeoutError
+
+import pytest
+
+import models
+from database import SessionLocal
+from utils.group_commit import GroupCommitWriter
+
+
+def count_books(db):
+    return db.query(models.Book).count()
+
+
+def test_writer_survives_a_failing_batch(client):
+    failures = [RuntimeError("could not connect")]
+
+    def session_factory():
+        if failures:
+            raise failures.pop()
+        return SessionLocal()
+
+    writer = GroupCommitWriter(session_factory=session_factory, max_wait_ms=1, timeout=5)
+    with pytest.raises(RuntimeError):
+        writer.submit(count_books)
+    # the same writer thread carries on with the next batch
+    assert writer.submit(count_books) == 0
+
+
+def test_submit_gives_up_after_the_timeout(client):
+    release = threading.Event()
+
+    def session_factory():
+        release.wait()
+        return SessionLocal()
+
+    writer = GroupCommitWriter(session_factory=session_factory, max_wait_ms=1, timeout=0.2)
+    try:
+        with pytest.raises(TimeoutError):
+            writer.submit(count_books)
+    finally:
+        release.set()
@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta
+
+import models
+from conftest import login, add_book
+from database import SessionLocal
+from utils.holds import expire_due_holds
+
+DUE_DATE = (datetime.utcnow() + timedelta(days=14)).isoformat()
+
+
+def checkout(client, headers, book_id):
+    return client.post("/transactions/checkout", json={"book_id": book_id, "due_date": DUE_DATE}, headers=headers)
+
+
+def hold_statuses(book_id):
+    db = SessionLocal()
+    try:
+        return sorted(status for (status,) in db.query(models.Hold.status).filter(models.Hold.book_id == book_id))
+    finally:
+        db.close()
+
+
+def test_returned_copy_goes_to_the_next_holder(client, admin):
+    book_id = add_book(client, admin, "isbn-1")
+    alice, bob = login(client, "alice@example.com"), login(client, "bob@example.com")
+
+    checkout(client, alice, book_id)
+    assert client.post("/holds/", json={"book_id": book_id}, headers=bob).status_code == 200
+    response = client.post("/transactions/return", json={"book_id": book_id}, headers=alice)
+    # kept aside for bob, not back on the shelf
+    assert response.json()["book"]["quantity"] == 0
+    assert checkout(client, alice, book_id).status_code == 400
+
+    assert checkout(client, bob, book_id).status_code == 200
+    assert hold_statuses(book_id) == ["fulfilled"]
+
+
+def test_added_copies_go_to_waiting_holders_first(client, admin):
+    book_id = add_book(client, admin, "isbn-1")
+    alice, bob = login(client, "alice@example.com"), login(client, "bob@example.com")
+
+    checkout(client, alice, book_id)
+    client.post("/holds/", json={"book_id": book_id}, headers=bob)
+    # two more copies, one for bob and one for the shelf
+    response = client.put(f"/books/{book_id}", json={"quantity": 2}, headers=admin)
+    assert response.json()["quantity"] == 1
+    assert hold_statuses(book_id) == ["ready"]
+
+
+def test_direct_checkout_fulfils_a_waiting_hold(client, admin):
+    book_id = add_book(client, admin, "isbn-1")
+    alice, bob = login(client, "alice@example.com"), login(client, "bob@example.com")
+
+    checkout(client, alice, book_id)
+    client.post("/holds/", json={"book_id": book_id}, headers=bob)
+    # a copy on the shelf while bob is still waiting
+    db = SessionLocal()
+    db.query(models.Book).filter(models.Book.id == book_id).update({models.Book.quantity: 1})
+    db.commit()
+    db.close()
+
+    assert checkout(client, bob, book_id).status_code == 200
+    assert hold_statuses(book_id) == ["fulfilled"]
+    # nobody is waiting any more, alice's copy goes back on the shelf
+    response = client.post("/transactions/return", json={"book_id": book_id}, headers=alice)
+    assert response.json()["book"]["quantity"] == 1
+
+
+def test_cancelling_a_ready_hold_passes_the_copy_on(client, admin):
+    book_id = add_book(client, admin, "isbn-1")
+    alice, bob = login(client, "alice@example.com"), login(client, "bob@example.com")
+
+    checkout(client, alice, book_id)
+    hold_id = client.post("/holds/", json={"book_id": book_id}, headers=bob).json()["id"]
+    # only the holder can cancel
+    assert client.delete(f"/holds/{hold_id}", headers=alice).status_code == 404
+
+    client.post("/transactions/return", json={"book_id": book_id}, headers=alice)
+    assert client.delete(f"/holds/{hold_id}", headers=bob).status_code == 200
+    assert client.delete(f"/holds/{hold_id}", headers=bob).status_code == 404
+    assert hold_statuses(book_id) == ["cancelled"]
+    assert checkout(client, alice, book_id).status_code == 200
+
+
+def test_fulfilled_hold_cannot_be_cancelled(client, admin):
+    book_id = add_book(client, admin, "isbn-1")
+    alice, bob = login(client, "alice@example.com"), login(client, "bob@example.com")
+
+    checkout(client, alice, book_id)
+    hold_id = client.post("/holds/", json={"book_id": book_id}, headers=bob).json()["id"]
+    client.post("/transactions/return", json={"book_id": book_id}, headers=alice)
+    checkout(client, bob, book_id)
+
+    assert client.delete(f"/holds/{hold_id}", headers=bob).status_code == 404
+    assert hold_statuses(book_id) == ["fulfilled"]
+    db = SessionLocal()
+    assert db.query(models.Book.quantity).filter(models.Book.id == book_id).scalar() == 0
+    db.close()
+
+
+def pickup_window_passes(book_id):
+    db = SessionLocal()
+    db.query(models.Hold).filter(models.Hold.book_id == book_id, models.Hold.status == "ready").update(
+        {models.Hold.expires_at: datetime.utcnow() - timedelta(minutes=1)}
+    )
+    db.commit()
+    db.close()
+
+
+def test_expired_hold_passes_the_copy_to_the_next_holder(client, admin):
+    book_id = add_book(client, admin, "isbn-1")
+    alice, bob, carol = (login(client, f"{name}@example.com") for name in ("alice", "bob", "carol"))
+
+    checkout(client, alice, book_id)
+    client.post("/holds/", json={"book_id": book_id}, headers=bob)
+    client.post("/holds/", json={"book_id": book_id}, headers=carol)
+    client.post("/transactions/return", json={"book_id": book_id}, headers=alice)
+    # nothing is due yet
+    assert expire_due_holds() == 0
+
+    pickup_window_passes(book_id)
+    assert expire_due_holds() == 1
+    assert hold_statuses(book_id) == ["expired", "ready"]
+    assert checkout(client, bob, book_id).status_code == 400
+    assert checkout(client, carol, book_id).status_code == 200
+
+
+def test_expired_hold_puts_the_copy_back_on_the_shelf(client, admin):
+    book_id = add_book(client, admin, "isbn-1")
+    alice, bob = login(client, "alice@example.com"), login(client, "bob@example.com")
+
+    checkout(client, alice, book_id)
+    client.post("/holds/", json={"book_id": book_id}, headers=bob)
+    client.post("/transactions/return", json={"book_id": book_id}, headers=alice)
+
+    pickup_window_passes(book_id)
+    # a full batch is followed by another one until a batch comes back short
+    assert expire_due_holds(batch_size=1) == 1
+    assert hold_statuses(book_id) == ["expired"]
+    assert checkout(client, alice, book_id).status_code == 200
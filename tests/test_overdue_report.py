@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta
+
+from conftest import login, add_book
+
+RULES = {"daily_rate": 1.0, "grace_days": 0}
+
+
+def checkout(client, headers, book_id, days_overdue):
+    due_date = (datetime.utcnow() - timedelta(days=days_overdue, hours=1)).isoformat()
+    response = client.post("/transactions/checkout", json={"book_id": book_id, "due_date": due_date}, headers=headers)
+    assert response.status_code == 200
+
+
+def test_pages_of_one_report_use_the_same_ranking(client, admin):
+    books = [add_book(client, admin, f"isbn-{i}") for i in range(3)]
+    users = [login(client, f"user{i}@example.com") for i in range(3)]
+    for days, user, book_id in zip((10, 20, 30), users, books):
+        checkout(client, user, book_id, days)
+
+    first = client.post("/transactions/overdue/report?per_page=1", json=RULES, headers=admin).json()
+    assert first["total_users"] == 3
+    assert [row["days_overdue"] for row in first["users"]] == [30]
+
+    # returning a book after the report was generated does not change the report as of then
+    client.post("/transactions/return", json={"book_id": books[2]}, headers=users[2])
+    pages = [
+        client.post(f"/transactions/overdue/report?per_page=1&page={page}&as_of={first['generated_at']}",
+                    json=RULES, headers=admin).json()
+        for page in (1, 2, 3)
+    ]
+    assert [page["users"][0]["days_overdue"] for page in pages] == [30, 20, 10]
+    assert {page["generated_at"] for page in pages} == {first["generated_at"]}
+
+    # a new report no longer has the returned loan
+    latest = client.post("/transactions/overdue/report", json=RULES, headers=admin).json()
+    assert [row["days_overdue"] for row in latest["users"]] == [20, 10]
+
+
+def test_report_as_of_the_future_is_rejected(client, admin):
+    as_of = (datetime.utcnow() + timedelta(days=1)).isoformat()
+    response = client.post(f"/transactions/overdue/report?as_of={as_of}", json=RULES, headers=admin)
+    assert response.status_code == 400
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+from conftest import login, add_book
+from database import SessionLocal
+from utils.recommendations import CoBorrowIndex, related_index, refresh_related_index
+
+DUE_DATE = (datetime.utcnow() + timedelta(days=14)).isoformat()
+
+
+def borrow(client, headers, *book_ids):
+    for book_id in book_ids:
+        assert client.post("/transactions/checkout", json={"book_id": book_id, "due_date": DUE_DATE}, headers=headers).status_code == 200
+
+
+def built(top_k):
+    index = CoBorrowIndex(top_k)
+    db = SessionLocal()
+    try:
+        index.build(db)
+    finally:
+        db.close()
+    return index
+
+
+def test_new_loans_give_the_same_neighbours_as_a_build(client, admin):
+    books = [add_book(client, admin, f"isbn-{i}", quantity=5) for i in range(1, 7)]
+    b1, b2, b3, b4, b5, b6 = books
+    u1, u2, u3, u4 = (login(client, f"user{i}@example.com") for i in range(1, 5))
+
+    borrow(client, u1, b1, b2)
+    borrow(client, u2, b2, b3)
+    refresh_related_index()
+    # the same history read by two more workers, one keeping only two neighbours per book
+    others = {top_k: built(top_k) for top_k in (2, 20)}
+
+    # higher book ids first, the ties have to end up ordered by book id anyway
+    borrow(client, u1, b5, b4)
+    borrow(client, u3, b6, b5, b2, b1)
+    borrow(client, u4, b6, b3, b5)
+
+    # this worker recorded its own checkouts, the others read them from the database
+    db = SessionLocal()
+    for index in others.values():
+        index._read_new_loans(db)
+    db.close()
+
+    fresh = {top_k: built(top_k) for top_k in (2, 20)}
+    for book_id in books:
+        assert related_index.related(book_id) == fresh[20].related(book_id)
+        for top_k, index in others.items():
+            assert index.related(book_id) == fresh[top_k].related(book_id)
+
+    # b1, b2 and b6 twice, then b3 and b4 once each
+    assert related_index.related(b5) == [b1, b2, b6, b3, b4]
+    assert others[2].related(b5) == [b1, b2]
+    assert related_index.related(b5, limit=3) == [b1, b2, b6]
+
+
+def test_related_route(client, admin):
+    books = [add_book(client, admin, f"isbn-{i}", quantity=5) for i in range(1, 4)]
+    borrow(client, login(client, "alice@example.com"), *books)
+    borrow(client, login(client, "bob@example.com"), books[0], books[2])
+
+    assert client.get("/books/999/related").status_code == 404
+    # not loaded until the background job has read the loans
+    assert client.get(f"/books/{books[0]}/related").status_code == 503
+
+    refresh_related_index()
+    response = client.get(f"/books/{books[0]}/related")
+    assert [book["id"] for book in response.json()] == [books[2], books[1]]
+    assert [book["id"] for book in client.get(f"/books/{books[1]}/related?limit=1").json()] == [books[0]]
+    assert client.get("/books/999/related").status_code == 404
@@ -0,0 +1,34 @@
+import os
+import sqlite3
+import tempfile
+
+from sqlalchemy import create_engine, inspect
+
+import models
+
+
+# A books table as created before the version column, like the one in the shipped library.db
+def test_upgrade_adds_missing_columns():
+    path = os.path.join(tempfile.mkdtemp(), "old.db")
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE books (id INTEGER NOT NULL PRIMARY KEY, title VARCHAR NOT NULL, author VARCHAR NOT NULL, "
+        "isbn VARCHAR NOT NULL, published_year INTEGER NOT NULL, category VARCHAR NOT NULL, "
+        "quantity INTEGER NOT NULL, created_at DATETIME)"
+    )
+    connection.execute("INSERT INTO books VALUES (1, 'Dune', 'Frank Herbert', '1', 1965, 'scifi', 1, NULL)")
+    connection.commit()
+    connection.close()
+
+    engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(bind=engine)
+    models.upgrade_schema(engine)
+    # a second start finds nothing to do
+    models.upgrade_schema(engine)
+
+    inspector = inspect(engine)
+    assert "version" in {column["name"] for column in inspector.get_columns("books")}
+    assert "ix_books_version" in {index["name"] for index in inspector.get_indexes("books")}
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("SELECT version FROM books").scalar() == 0
+    engine.dispose()
@@ -0,0 +1,105 @@
+import models
+from conftest import add_book
+from database import SessionLocal
+from utils import search
+from utils.search import TrigramIndex, book_index, refresh_book_index
+
+BOOKS = [
+    (1, "Dune", "Frank Herbert"),
+    (2, "Dune Messiah", "Frank Herbert"),
+    (3, "The Hobbit", "J. R. R. Tolkien"),
+    (4, "Emma", "Jane Austen"),
+]
+
+
+def index_of(books):
+    index = TrigramIndex()
+    for book_id, title, author in books:
+        index.add(book_id, title, author)
+    return index
+
+
+def matches(index, query, threshold=search.FUZZY_DEFAULT_THRESHOLD):
+    return [book_id for book_id, similarity in index.search(query, threshold)]
+
+
+def test_misspelled_queries_are_ranked():
+    index = index_of(BOOKS)
+
+    assert matches(index, "hobit") == [3]
+    # same share of the query found in both, the shorter title is closer
+    assert matches(index, "frank herbet") == [1, 2]
+    assert matches(index, "jane austin") == [4]
+    # too few of the query trigrams in the book
+    assert matches(index, "jane austin", threshold=0.8) == []
+    assert matches(index, "hobit tolkein", threshold=0.8) == []
+    assert index.search("emma") == [(4, 1.0)]
+    # no letters, nothing to match
+    assert index.search("!!") == []
+
+
+def test_renamed_and_removed_books():
+    index = index_of(BOOKS)
+
+    index.add(1, "Children of Dune", "Frank Herbert")
+    assert len(index) == 4
+    assert matches(index, "children") == [1]
+    # the old title is gone, only the title containing the word matches
+    assert matches(index, "dune messiah") == [2, 1]
+    index.add(1, "Emma", "Frank Herbert")
+    assert matches(index, "dune") == [2]
+
+    index.remove(2)
+    index.remove(2)
+    assert len(index) == 3
+    assert matches(index, "dune") == []
+    assert matches(index, "emma") == [4, 1]
+
+
+def test_compaction_keeps_the_results():
+    words = ["dune", "hobbit", "emma"]
+    books = [(book_id, f"Title {book_id} {words[book_id % 3]}", "Author") for book_id in range(1, 1501)]
+    index = index_of(books)
+    removed = [book_id for book_id in range(1, 1501) if book_id % 5]
+    for book_id in removed:
+        index.remove(book_id)
+    # the removed books were dropped from the posting lists
+    assert index._dead < search.COMPACT_MIN_DEAD
+    assert len(index._slot_book) < 1500
+
+    kept = index_of([book for book in books if book[0] % 5 == 0])
+    for query in ["dune", "hobit", "title 15 emma", "author", "title 1000"]:
+        assert index.search(query, limit=100) == kept.search(query, limit=100)
+    # and the index still takes new books after it
+    index.add(2000, "Dune", "Frank Herbert")
+    assert matches(index, "frank herbert") == [2000]
+
+
+def test_fuzzy_search_route(client, admin):
+    dune = add_book(client, admin, "isbn-1")
+    client.put(f"/books/{dune}", json={"title": "Dune"}, headers=admin)
+    # not loaded until the background job has read the books
+    assert client.get("/books/search?q=dnue&fuzzy=true").status_code == 503
+
+    refresh_book_index()
+    response = client.get("/books/search?q=dune&fuzzy=true&threshold=0.5")
+    assert [book["title"] for book in response.json()] == ["Dune"]
+    assert client.get("/books/search?q=zzzz&fuzzy=true").json() == []
+
+
+def test_refresh_picks_up_changes_made_by_other_workers(client, admin):
+    first, second, third = (add_book(client, admin, isbn) for isbn in ("isbn-1", "isbn-2", "isbn-3"))
+    refresh_book_index()
+    assert len(book_index) == 3
+
+    # written by another worker, this one's index does not see it
+    db = SessionLocal()
+    db.query(models.Book).filter(models.Book.id == second).delete()
+    db.get(models.Book, third).title = "Emma"
+    db.commit()
+    db.close()
+    assert sorted(matches(book_index, "book isbn")) == [first, second, third]
+
+    refresh_book_index()
+    assert sorted(matches(book_index, "book isbn")) == [first]
+    assert matches(book_index, "emma") == [third]
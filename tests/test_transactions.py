@@ -0,0 +1,138 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import text
+
+import models
+import schemas
+from conftest import login, add_book
+from database import SessionLocal, IS_SQLITE, DB_STATEMENT_TIMEOUT_MS, library_engine
+from routers.transactions import _checkout
+from utils.group_commit import GroupCommitWriter
+
+DUE_DATE = (datetime.utcnow() + timedelta(days=14)).isoformat()
+
+
+def book_quantity(book_id):
+    db = SessionLocal()
+    try:
+        return db.query(models.Book.quantity).filter(models.Book.id == book_id).scalar()
+    finally:
+        db.close()
+
+
+def test_checkout_and_return(client, admin):
+    book_id = add_book(client, admin, "isbn-1")
+    alice = login(client, "alice@example.com")
+    bob = login(client, "bob@example.com")
+
+    response = client.post("/transactions/checkout", json={"book_id": book_id, "due_date": DUE_DATE}, headers=alice)
+    assert response.status_code == 200
+    assert response.json()["book"]["quantity"] == 0
+
+    # the only copy is out
+    response = client.post("/transactions/checkout", json={"book_id": book_id, "due_date": DUE_DATE}, headers=bob)
+    assert response.status_code == 400
+
+    assert [loan["book_id"] for loan in client.get("/transactions/my-books", headers=alice).json()] == [book_id]
+
+    response = client.post("/transactions/return", json={"book_id": book_id}, headers=alice)
+    assert response.status_code == 200
+    assert response.json()["is_returned"] is True
+    assert book_quantity(book_id) == 1
+
+    # returned already
+    response = client.post("/transactions/return", json={"book_id": book_id}, headers=alice)
+    assert response.status_code == 404
+
+
+def test_checkout_same_book_twice(client, admin):
+    book_id = add_book(client, admin, "isbn-1", quantity=2)
+    alice = login(client, "alice@example.com")
+
+    client.post("/transactions/checkout", json={"book_id": book_id, "due_date": DUE_DATE}, headers=alice)
+    response = client.post("/transactions/checkout", json={"book_id": book_id, "due_date": DUE_DATE}, headers=alice)
+    assert response.status_code == 400
+    assert book_quantity(book_id) == 1
+
+
+# Many users check out the same title at once, each with its own session, exactly `copies` of them succeed
+def run_concurrent_checkouts(client, admin, write, copies=3, users=12):
+    book_id = add_book(client, admin, "isbn-1", quantity=copies)
+    db = SessionLocal()
+    for i in range(users):
+        db.add(models.User(id=1000 + i, name=f"user {i}", email=f"user{i}@example.com", password="x"))
+    db.commit()
+    db.close()
+
+    barrier = threading.Barrier(users)
+    outcomes = []
+
+    def worker(user_id):
+        checkout = schemas.TransactionCreate(book_id=book_id, due_date=DUE_DATE)
+        barrier.wait()
+        try:
+            write(lambda session: _checkout(session, user_id, checkout))
+            outcomes.append("ok")
+        except HTTPException as error:
+            outcomes.append(error.status_code)
+
+    threads = [threading.Thread(target=worker, args=(1000 + i,)) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert outcomes.count("ok") == copies
+    assert outcomes.count(400) == users - copies
+    assert book_quantity(book_id) == 0
+    db = SessionLocal()
+    assert db.query(models.Transaction).filter(models.Transaction.book_id == book_id).count() == copies
+    db.close()
+
+
+def test_concurrent_checkouts_of_one_title(client, admin):
+    def write(operation):
+        db = SessionLocal()
+        try:
+            result = operation(db)
+            db.commit()
+            return result
+        finally:
+            db.close()
+
+    run_concurrent_checkouts(client, admin, write)
+
+
+def test_concurrent_checkouts_of_one_title_group_commit(client, admin):
+    writer = GroupCommitWriter(max_batch=8, max_wait_ms=5)
+    run_concurrent_checkouts(client, admin, writer.submit)
+
+
+# A checkout holding the lock on one book must not hold up checkouts of other books
+@pytest.mark.skipif(IS_SQLITE, reason="sqlite has a single writer, only row locking databases can do this")
+def test_checkouts_of_different_titles_do_not_wait(client, admin):
+    first = add_book(client, admin, "isbn-1")
+    second = add_book(client, admin, "isbn-2")
+    alice = login(client, "alice@example.com")
+
+    blocker = SessionLocal()
+    blocker.query(models.Book).filter(models.Book.id == first).with_for_update().one()
+    try:
+        start = time.monotonic()
+        response = client.post("/transactions/checkout", json={"book_id": second, "due_date": DUE_DATE}, headers=alice)
+        assert response.status_code == 200
+        assert time.monotonic() - start < 2
+    finally:
+        blocker.rollback()
+        blocker.close()
+
+
+@pytest.mark.skipif(library_engine.url.get_driver_name() != "psycopg2", reason="statement timeout is set through libpq options")
+def test_statement_timeout_is_set(client):
+    with library_engine.connect() as connection:
+        setting = connection.execute(text("SELECT setting FROM pg_settings WHERE name = 'statement_timeout'")).scalar()
+    assert int(setting) == DB_STATEMENT_TIMEOUT_MS
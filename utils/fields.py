@@ -0,0 +1,54 @@
+# Helpers for batch lookups (?ids=1,2,3) and sparse fieldsets (?fields=id,title) on list routes.
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+
+# Upper limit of ids accepted by one batch lookup, keeps the IN (...) list small
+MAX_BATCH_IDS = 100
+
+
+# Turns "1,2,3" into [1, 2, 3], None when the parameter was not sent
+def parse_ids(ids: str):
+    if ids is None:
+        return None
+
+    try:
+        id_list = [int(value) for value in ids.split(",") if value.strip()]
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="ids must be a comma separated list of integers"
+        )
+
+    if len(id_list) > MAX_BATCH_IDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_BATCH_IDS} ids can be requested at once"
+        )
+    # drop duplicates but keep the order in which they were asked
+    return list(dict.fromkeys(id_list))
+
+
+# Maps "id,title" to the model columns to load. Only plain columns which are also part of the
+# response schema can be asked for, so hidden columns (like the user password) never leak out.
+def parse_fields(fields: str, model, response_schema):
+    if not fields:
+        return None
+
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    allowed = [name for name in response_schema.model_fields if name in model.__table__.columns]
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(unknown)}. Allowed fields: {', '.join(allowed)}"
+        )
+
+    # id is always sent back so the client can match rows
+    if "id" not in names:
+        names.insert(0, "id")
+    return [getattr(model, name) for name in dict.fromkeys(names)]
+
+
+# Rows from a column only query (query.with_entities) converted to JSON ready dicts
+def sparse_rows(rows):
+    return jsonable_encoder([row._asdict() for row in rows])
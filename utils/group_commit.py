@@ -0,0 +1,147 @@
+# Optional group commit for the circulation writes (checkout / return).
+# Normally every request commits on its own, and on sqlite every commit is a separate fsync under the
+# single writer lock. With GROUP_COMMIT=1 the writes are handed to one writer thread instead. It applies
+# all the writes waiting in its queue inside one transaction, each in its own SAVEPOINT so a failing
+# request does not undo the others, commits once and then hands every request its own result.
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, TimeoutError
+
+from fastapi import HTTPException, status
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, IS_SQLITE
+
+GROUP_COMMIT_ENABLED = os.getenv("GROUP_COMMIT", "0") == "1"
+# Only for sqlite's single writer. PostgreSQL commits checkouts of different books in parallel, funnelling
+# them through one thread would serialize them.
+if GROUP_COMMIT_ENABLED and not IS_SQLITE:
+    raise RuntimeError("GROUP_COMMIT=1 is only supported with sqlite, unset it for this DATABASE_URL")
+# Most writes applied in one transaction
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "64"))
+# How long the writer waits for more writes once it has one. This is only the wait for a batch to fill,
+# a request also waits for the writes queued ahead of it, which run one after the other.
+GROUP_COMMIT_MAX_WAIT_MS = float(os.getenv("GROUP_COMMIT_MAX_WAIT_MS", "2"))
+# How long a request waits for its batch to be committed before it gives up
+GROUP_COMMIT_TIMEOUT_SECONDS = float(os.getenv("GROUP_COMMIT_TIMEOUT_SECONDS", "30"))
+
+
+class GroupCommitWriter:
+    def __init__(self, session_factory=SessionLocal, max_batch: int = GROUP_COMMIT_MAX_BATCH,
+                 max_wait_ms: float = GROUP_COMMIT_MAX_WAIT_MS, timeout: float = GROUP_COMMIT_TIMEOUT_SECONDS):
+        self._session_factory = session_factory
+        self._max_batch = max_batch
+        self._max_wait = max_wait_ms / 1000
+        self._timeout = timeout
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    # Runs write(db) in the next batch and blocks until that batch is committed.
+    # Returns what write returned, or raises what it raised. write must not commit itself and should
+    # return plain data (e.g. a pydantic schema), the session is closed before the caller gets it back.
+    # Raises TimeoutError when the batch is not committed within the timeout.
+    def submit(self, write):
+        self._start()
+        future = Future()
+        self._queue.put((write, future))
+        try:
+            return future.result(timeout=self._timeout)
+        except TimeoutError:
+            # a write which has not been started yet is dropped, one already in a batch may still commit
+            if future.cancel():
+                raise TimeoutError("group commit writer did not get to the write in time, it was not applied")
+            raise TimeoutError("group commit writer did not commit the write in time, it may still be applied")
+
+    def _start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="group-commit-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self._max_wait
+            while len(batch) < self._max_batch:
+                try:
+                    # take what is already queued, then wait for more until the deadline
+                    batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self._apply(batch)
+            except Exception as error:
+                # e.g. no connection could be opened, or the rollback failed on a dead connection. The thread
+                # has to keep going, every request of the batch still waiting gets the error.
+                for write, future in batch:
+                    _settle(future, error=error)
+
+    def _apply(self, batch):
+        db: Session = self._session_factory()
+        outcomes = []
+        try:
+            if IS_SQLITE:
+                # pysqlite only opens a transaction before DML, without this the first SAVEPOINT would
+                # become the transaction and every RELEASE a commit of its own
+                db.execute(text("BEGIN IMMEDIATE"))
+            for write, future in batch:
+                # the request gave up waiting and cancelled it
+                if not future.set_running_or_notify_cancel():
+                    continue
+                savepoint = db.begin_nested()
+                try:
+                    result = write(db)
+                    savepoint.commit()
+                    outcomes.append((future, result, None))
+                except Exception as error:
+                    savepoint.rollback()
+                    outcomes.append((future, None, error))
+            db.commit()
+        except Exception as error:
+            db.rollback()
+            # nothing of the batch was committed, every request which had not failed already gets this error
+            done = {id(future) for future, result, failure in outcomes}
+            for future, result, failure in outcomes:
+                _settle(future, error=failure or error)
+            for write, future in batch:
+                if id(future) not in done:
+                    _settle(future, error=error)
+            return
+        finally:
+            db.close()
+
+        for future, result, failure in outcomes:
+            _settle(future, result, failure)
+
+
+# Hands a request its result, unless it already has one or was cancelled after timing out
+def _settle(future: Future, result=None, error: Exception = None):
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+# Shared writer used by the transactions router
+group_writer = GroupCommitWriter()
+
+
+# Runs a circulation write either through the group commit writer or directly on the request session
+def run_write(db: Session, write):
+    if GROUP_COMMIT_ENABLED:
+        try:
+            return group_writer.submit(write)
+        except TimeoutError as error:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(error))
+    result = write(db)
+    db.commit()
+    return result
@@ -0,0 +1,83 @@
+# Helpers for the holds / waitlist, shared by the holds and transactions routers.
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+import models
+from database import SessionLocal
+
+# How long a copy is kept aside for the next holder before it moves down the queue
+HOLD_PICKUP_WINDOW_HOURS = 48
+# Number of expired holds processed in one run of the expiry job
+HOLD_EXPIRY_BATCH_SIZE = 100
+# How often every worker looks for holds whose pickup window has passed
+HOLD_EXPIRY_INTERVAL_SECONDS = 60
+
+# Statuses in which a hold is still alive and occupies a place in the queue
+ACTIVE_HOLD_STATUSES = ("waiting", "ready")
+
+
+# Hands a copy of the book which just came back to the next holder in the queue.
+# If nobody is waiting the copy goes back on the shelf. The caller must hold the lock on the book row
+# and commits, so the allocation is part of the same transaction as the return.
+def allocate_copy(db: Session, book: models.Book, now: datetime = None):
+    now = now or datetime.utcnow()
+
+    # Oldest waiting hold of this book, served by the (book_id, status, created_at) index
+    next_hold = db.query(models.Hold).filter(
+        models.Hold.book_id == book.id,
+        models.Hold.status == "waiting"
+    ).order_by(models.Hold.created_at, models.Hold.id).first()
+
+    if not next_hold:
+        book.quantity += 1
+        return None
+
+    # Copy is reserved for this holder, so quantity is not incremented
+    next_hold.status = "ready"
+    next_hold.ready_at = now
+    next_hold.expires_at = now + timedelta(hours=HOLD_PICKUP_WINDOW_HOURS)
+    # sessions do not autoflush, without this a second copy in the same transaction would pick this hold again
+    db.flush()
+    return next_hold
+
+
+# Expires ready holds whose pickup window has passed and passes their copy on to the next holder.
+# Works through at most batch_size holds per call, returns how many were expired.
+def expire_holds(db: Session, batch_size: int = HOLD_EXPIRY_BATCH_SIZE, now: datetime = None):
+    now = now or datetime.utcnow()
+
+    due_holds = db.query(models.Hold.id, models.Hold.book_id).filter(
+        models.Hold.status == "ready",
+        models.Hold.expires_at < now
+    ).order_by(models.Hold.expires_at).limit(batch_size).all()
+
+    expired = 0
+    for hold_id, book_id in due_holds:
+        # Lock book first and then the hold, same order as checkout and return
+        book = db.query(models.Book).filter(models.Book.id == book_id).with_for_update().first()
+        hold = db.query(models.Hold).filter(models.Hold.id == hold_id).with_for_update().first()
+        # Hold may have been picked up or cancelled since it was selected
+        if not hold or hold.status != "ready":
+            continue
+
+        hold.status = "expired"
+        if book:
+            allocate_copy(db, book, now)
+        expired += 1
+
+    return expired
+
+
+# Run by every worker in the background, see main.py. Expires the due holds one committed batch at a
+# time until a batch comes back short. Workers running it at the same time are kept apart by the row locks.
+def expire_due_holds(batch_size: int = HOLD_EXPIRY_BATCH_SIZE):
+    total = 0
+    while True:
+        db = SessionLocal()
+        try:
+            expired = expire_holds(db, batch_size)
+            db.commit()
+        finally:
+            db.close()
+        total += expired
+        if expired < batch_size:
+            return total
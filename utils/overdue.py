@@ -0,0 +1,131 @@
+# Overdue report and fine calculation for POST /transactions/overdue/report.
+# Overdue loans are read as plain columns in batches, days overdue and fines are computed with numpy
+# for a whole batch at once, and the result is aggregated per user.
+# A report is computed as of a point in time, so the pages of one report all come from the same ranking.
+# The last few reports are kept per process for paging, and a worker which does not have one computes
+# the same result again from the as_of time.
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import select, cast, extract, or_, Float
+from sqlalchemy.orm import Session
+
+import models
+import schemas
+
+# Overdue loans read from the database per batch
+OVERDUE_BATCH_SIZE = 50000
+# Reports kept in memory per process, by fine rules and as_of time
+OVERDUE_REPORT_CACHE_SIZE = 8
+
+_report_cache = OrderedDict()
+_report_cache_lock = threading.Lock()
+
+
+# Group by user: sums of loans, days and fines, and the oldest due date (as int64 microseconds)
+def _aggregate(user_ids, loans, days, fines, oldest):
+    users, rows = np.unique(user_ids, return_inverse=True)
+    user_oldest = np.full(len(users), np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(user_oldest, rows, oldest)
+    return (
+        users,
+        np.bincount(rows, weights=loans, minlength=len(users)).astype(np.int64),
+        np.bincount(rows, weights=days, minlength=len(users)).astype(np.int64),
+        np.bincount(rows, weights=fines, minlength=len(users)),
+        user_oldest,
+    )
+
+
+# Daily fine rate of every book, indexed by book id, so a batch of loans gets its rates in one lookup
+def _rates_by_book(db: Session, rules: schemas.FineRules):
+    books = db.execute(select(models.Book.id, models.Book.category)).all()
+    rates = np.full(max((book_id for book_id, category in books), default=0) + 1, rules.daily_rate)
+    if books:
+        book_ids, categories = zip(*books)
+        rates[np.array(book_ids)] = [rules.category_rates.get(category, rules.daily_rate) for category in categories]
+    return rates
+
+
+# Days overdue and fine of every loan in one batch of (user_id, book_id, due date in epoch seconds) rows
+def _batch_fines(rows, rules: schemas.FineRules, rates: np.ndarray, now: float):
+    user_ids, book_ids, due = (np.array(column) for column in zip(*rows))
+    due = due.astype(np.float64)
+
+    # whole days past the due date, the grace period is not charged
+    days = np.floor((now - due) / 86400).astype(np.int64)
+    charged_days = np.maximum(days - rules.grace_days, 0)
+
+    # books missing from the rates (deleted since) are charged the default rate
+    known = book_ids < len(rates)
+    loan_rates = np.where(known, rates[np.where(known, book_ids, 0)], rules.daily_rate)
+    fines = charged_days * loan_rates
+    if rules.max_fine_per_loan is not None:
+        fines = np.minimum(fines, rules.max_fine_per_loan)
+
+    oldest = (due * 1e6).astype(np.int64)
+    return user_ids.astype(np.int64), np.ones(len(user_ids), dtype=np.int64), days, fines, oldest
+
+
+# Reads all the loans overdue at `now` and returns the per user totals, users with the highest fine first.
+# Loans checked out after `now`, or returned since, are counted as they were at `now`.
+# Returns a dict of numpy arrays: user_id, overdue_books, days_overdue, fine, oldest_due_date.
+def compute_overdue_report(db: Session, rules: schemas.FineRules, now: datetime = None,
+                           batch_size: int = OVERDUE_BATCH_SIZE):
+    now = now or datetime.utcnow()
+    # datetimes are stored as naive UTC, epoch seconds are compared the same way on sqlite and PostgreSQL
+    now_epoch = (now - datetime(1970, 1, 1)).total_seconds()
+    rates = _rates_by_book(db, rules)
+
+    # plain columns through Core, no ORM rows and no datetime parsing per row
+    query = select(
+        models.Transaction.user_id,
+        models.Transaction.book_id,
+        cast(extract("epoch", models.Transaction.due_date), Float)
+    ).where(
+        models.Transaction.due_date < now,
+        models.Transaction.checkout_date <= now,
+        or_(models.Transaction.is_returned == False, models.Transaction.return_date > now)
+    )
+    result = db.execute(query, execution_options={"yield_per": batch_size})
+
+    # every batch is reduced to one row per user straight away, so memory stays bounded by the users
+    partials = [_aggregate(*_batch_fines(rows, rules, rates, now_epoch)) for rows in result.partitions()]
+    if partials:
+        users, loans, days, fines, oldest = (np.concatenate(parts) for parts in zip(*partials))
+    else:
+        users = loans = days = oldest = np.zeros(0, dtype=np.int64)
+        fines = np.zeros(0, dtype=np.float64)
+    users, loans, days, fines, oldest = _aggregate(users, loans, days, fines, oldest)
+
+    if rules.max_fine_per_user is not None:
+        fines = np.minimum(fines, rules.max_fine_per_user)
+    fines = np.round(fines, 2)
+
+    # highest fine first, then most days overdue, then user id for a stable order between pages
+    order = np.lexsort((users, -days, -fines))
+    return {
+        "user_id": users[order],
+        "overdue_books": loans[order],
+        "days_overdue": days[order],
+        "fine": fines[order],
+        "oldest_due_date": oldest[order].astype("datetime64[us]"),
+    }
+
+
+# The report as of `as_of`, computed once per process and then served from memory for the other pages
+def cached_overdue_report(db: Session, rules: schemas.FineRules, as_of: datetime):
+    key = (rules.model_dump_json(), as_of)
+    with _report_cache_lock:
+        report = _report_cache.get(key)
+        if report is not None:
+            _report_cache.move_to_end(key)
+            return report
+
+    report = compute_overdue_report(db, rules, as_of)
+    with _report_cache_lock:
+        _report_cache[key] = report
+        while len(_report_cache) > OVERDUE_REPORT_CACHE_SIZE:
+            _report_cache.popitem(last=False)
+    return report
@@ -0,0 +1,22 @@
+# Background jobs run by every worker process, e.g. keeping the in memory indexes in sync with the database.
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# Runs job() now and then every interval_seconds in a daemon thread. A failing run is reported and the
+# job is tried again at the next interval.
+def run_periodically(name: str, interval_seconds: float, job):
+    def loop():
+        while True:
+            try:
+                job()
+            except Exception:
+                logger.exception("%s failed", name)
+            time.sleep(interval_seconds)
+
+    thread = threading.Thread(target=loop, name=name, daemon=True)
+    thread.start()
+    return thread
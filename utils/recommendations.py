@@ -0,0 +1,254 @@
+# "Borrowed together" recommendations for GET /books/{book_id}/related.
+# Two books are related when the same users borrowed both of them. The co-borrow counts of all book
+# pairs are computed in one batch with SciPy (books x books = B.T @ B, where B is the user x book
+# borrow matrix), and the best neighbours of every book are kept in a compact array which is what
+# requests are served from. New loans update the affected rows in place.
+# Every worker keeps its own copy: it runs the batch at startup and every RELATED_REBUILD_SECONDS in the
+# background, and in between reads the loans recorded through any worker every RELATED_REFRESH_SECONDS.
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal
+from utils.versions import VersionWatermark
+
+# Number of neighbours kept per book
+RELATED_TOP_K = 20
+# How often every worker reads the loans added since its last read
+RELATED_REFRESH_SECONDS = 5
+# How often every worker recomputes the whole matrix, which also folds the recorded loans into it
+RELATED_REBUILD_SECONDS = 3600
+
+
+class CoBorrowIndex:
+    def __init__(self, top_k: int = RELATED_TOP_K):
+        self.top_k = top_k
+        self.loaded = False
+        self._lock = threading.Lock()
+        # serializes the batch and the reads of new loans, build() is also called on its own by the admin route
+        self._refresh_lock = threading.RLock()
+        self._built_at = None
+        # loans recorded while a batch reads the history, replayed on top of it (None when not building)
+        self._pending = None
+        self._reset()
+
+    def _reset(self):
+        # book id <-> row of the matrix
+        self._book_row = {}
+        self._row_book = []
+        # co-borrow counts from the last batch, csr with sorted column indices
+        self._matrix = sparse.csr_matrix((0, 0), dtype=np.int32)
+        # counts added by loans recorded since the batch, row -> {column: count}
+        self._delta = defaultdict(lambda: defaultdict(int))
+        # user id -> ids of the books the user has ever borrowed
+        self._user_books = defaultdict(set)
+        # top k neighbour rows (-1 when there are fewer) and their co-borrow counts, best first
+        self._neighbours = np.full((0, self.top_k), -1, dtype=np.int32)
+        self._scores = np.zeros((0, self.top_k), dtype=np.int32)
+        # transaction ids already read, loans are found by id between two batches
+        self._watermark = VersionWatermark(RELATED_REFRESH_SECONDS)
+
+    # Run in the background by every worker: the batch the first time and every RELATED_REBUILD_SECONDS,
+    # otherwise only the loans added since the last read
+    def refresh(self, db: Session):
+        with self._refresh_lock:
+            elapsed = time.monotonic() - self._built_at if self._built_at is not None else None
+            if elapsed is None or elapsed >= RELATED_REBUILD_SECONDS:
+                self.build(db)
+            elif elapsed >= RELATED_REFRESH_SECONDS:
+                self._read_new_loans(db)
+
+    # Batch job, computes the whole matrix from the transactions table
+    def build(self, db: Session):
+        with self._refresh_lock:
+            with self._lock:
+                self._pending = []
+            try:
+                self._build(db)
+            finally:
+                # a failed batch must not leave the loans piling up
+                with self._lock:
+                    self._pending = None
+
+    def _build(self, db: Session):
+        watermark = VersionWatermark(RELATED_REFRESH_SECONDS)
+        watermark.begin()
+        highest = db.query(func.max(models.Transaction.id)).scalar() or 0
+        pairs = np.array(
+            db.query(models.Transaction.user_id, models.Transaction.book_id).distinct().all(),
+            dtype=np.int64
+        ).reshape(-1, 2)
+
+        users, user_rows = np.unique(pairs[:, 0], return_inverse=True)
+        books, book_rows = np.unique(pairs[:, 1], return_inverse=True)
+
+        borrowed = sparse.csr_matrix(
+            (np.ones(len(pairs), dtype=np.int32), (user_rows, book_rows)),
+            shape=(len(users), len(books))
+        )
+        matrix = (borrowed.T @ borrowed).tocsr()
+        # a book is not related to itself
+        matrix.setdiag(0)
+        matrix.eliminate_zeros()
+        matrix.sort_indices()
+        neighbours, scores = self._top_k(matrix, books)
+
+        with self._lock:
+            self._reset()
+            self._matrix = matrix
+            self._row_book = books.tolist()
+            self._book_row = {book_id: row for row, book_id in enumerate(self._row_book)}
+            for user_id, book_id in pairs.tolist():
+                self._user_books[user_id].add(book_id)
+            self._neighbours, self._scores = neighbours, scores
+            watermark.end(highest)
+            self._watermark = watermark
+
+            # loans recorded while the history was read, the ones it already had are skipped by _record
+            pending, self._pending = self._pending, []
+            for user_id, book_id in pending:
+                self._record(user_id, book_id)
+            self._built_at = time.monotonic()
+            self.loaded = True
+
+    # Loans added since the last read, by any worker. Loans already known (e.g. recorded by this worker's
+    # own checkouts, or re-read because of the watermark overlap) are skipped by _record.
+    def _read_new_loans(self, db: Session):
+        since = self._watermark.begin()
+        loans = db.query(models.Transaction.id, models.Transaction.user_id, models.Transaction.book_id).filter(
+            models.Transaction.id > since
+        ).order_by(models.Transaction.id).all()
+        with self._lock:
+            for transaction_id, user_id, book_id in loans:
+                self._record(user_id, book_id)
+            self._watermark.end(loans[-1][0] if loans else 0)
+
+    # Top k columns of every row of the matrix, vectorized over all the non zero entries at once.
+    # books maps a column to its book id, equal counts are ordered by book id.
+    def _top_k(self, matrix, books):
+        row_count = matrix.shape[0]
+        neighbours = np.full((row_count, self.top_k), -1, dtype=np.int32)
+        scores = np.zeros((row_count, self.top_k), dtype=np.int32)
+
+        rows = np.repeat(np.arange(row_count), np.diff(matrix.indptr))
+        # by row, then highest count first, then lowest book id for stable ties
+        order = np.lexsort((books[matrix.indices], -matrix.data, rows))
+        rows, columns, counts = rows[order], matrix.indices[order], matrix.data[order]
+        rank = np.arange(len(rows)) - matrix.indptr[rows]
+
+        kept = rank < self.top_k
+        neighbours[rows[kept], rank[kept]] = columns[kept]
+        scores[rows[kept], rank[kept]] = counts[kept]
+        return neighbours, scores
+
+    # Ids of the books most often borrowed together with book_id, best first
+    def related(self, book_id: int, limit: int = RELATED_TOP_K):
+        with self._lock:
+            row = self._book_row.get(book_id)
+            if row is None:
+                return []
+            neighbours = self._neighbours[row, :limit]
+            return [self._row_book[column] for column in neighbours[neighbours >= 0].tolist()]
+
+    # Called after a checkout is committed, so this worker serves it straight away. The other workers
+    # read it from the database on their next refresh.
+    def record_loan(self, user_id: int, book_id: int):
+        with self._lock:
+            if self._pending is not None:
+                # a batch is reading the history, it may or may not see this loan
+                self._pending.append((user_id, book_id))
+            if not self.loaded:
+                # the first build reads this loan from the database
+                return
+            self._record(user_id, book_id)
+
+    # Every book the user borrowed before gets one more co-borrow with the new book, only the rows of
+    # those books are updated. The caller holds the lock.
+    def _record(self, user_id: int, book_id: int):
+        history = self._user_books[user_id]
+        if book_id in history:
+            return
+
+        row = self._row(book_id)
+        for other_book_id in history:
+            other = self._row(other_book_id)
+            self._delta[row][other] += 1
+            self._delta[other][row] += 1
+            self._bump(other, row)
+        history.add(book_id)
+        self._refresh_row(row)
+
+    def _row(self, book_id: int):
+        row = self._book_row.get(book_id)
+        if row is None:
+            row = len(self._row_book)
+            self._row_book.append(book_id)
+            self._book_row[book_id] = row
+            if row >= len(self._neighbours):
+                # grow the arrays with room for more new books
+                extra = max(16, len(self._neighbours) // 2)
+                self._neighbours = np.vstack([self._neighbours, np.full((extra, self.top_k), -1, dtype=np.int32)])
+                self._scores = np.vstack([self._scores, np.zeros((extra, self.top_k), dtype=np.int32)])
+        return row
+
+    def _count(self, row: int, column: int):
+        count = self._delta.get(row, {}).get(column, 0)
+        if row < self._matrix.shape[0]:
+            start, end = self._matrix.indptr[row], self._matrix.indptr[row + 1]
+            position = start + np.searchsorted(self._matrix.indices[start:end], column)
+            if position < end and self._matrix.indices[position] == column:
+                count += int(self._matrix.data[position])
+        return count
+
+    # The count of (row, column) went up by one, it only changes the top k of row if column is
+    # already in it or now beats the last one, (count, -book id) like the order of the batch
+    def _bump(self, row: int, column: int):
+        neighbours, scores = self._neighbours[row], self._scores[row]
+        count = self._count(row, column)
+        found = np.flatnonzero(neighbours == column)
+        if len(found):
+            scores[found[0]] = count
+        elif neighbours[-1] < 0 or (count, -self._row_book[column]) > (scores[-1], -self._row_book[neighbours[-1]]):
+            neighbours[-1], scores[-1] = column, count
+        else:
+            return
+        # empty places (-1) have a count of 0 and stay at the end
+        book_ids = [self._row_book[neighbour] if neighbour >= 0 else 0 for neighbour in neighbours.tolist()]
+        order = np.lexsort((book_ids, -scores))
+        self._neighbours[row], self._scores[row] = neighbours[order], scores[order]
+
+    # Recomputes the top k of one row from the batch counts plus the recorded loans
+    def _refresh_row(self, row: int):
+        counts = defaultdict(int)
+        if row < self._matrix.shape[0]:
+            start, end = self._matrix.indptr[row], self._matrix.indptr[row + 1]
+            for column, count in zip(self._matrix.indices[start:end].tolist(), self._matrix.data[start:end].tolist()):
+                counts[column] += count
+        for column, count in self._delta.get(row, {}).items():
+            counts[column] += count
+
+        best = sorted(counts.items(), key=lambda item: (-item[1], self._row_book[item[0]]))[:self.top_k]
+        self._neighbours[row] = -1
+        self._scores[row] = 0
+        for rank, (column, count) in enumerate(best):
+            self._neighbours[row, rank] = column
+            self._scores[row, rank] = count
+
+
+# Shared index used by the books and transactions routers
+related_index = CoBorrowIndex()
+
+
+# Run by every worker in the background, see main.py
+def refresh_related_index():
+    db = SessionLocal()
+    try:
+        related_index.refresh(db)
+    finally:
+        db.close()
@@ -0,0 +1,277 @@
+# In memory trigram index over book titles and authors, used by the fuzzy mode of /books/search.
+# Works like PostgreSQL's pg_trgm: every word is split into 3 letter pieces, and a book matches a
+# misspelled query when enough of the query's pieces are found in it.
+# The index lives in the process. Every worker builds its own copy in the background at startup and
+# then refreshes it from the books table every INDEX_REFRESH_SECONDS, so books added, renamed or deleted
+# through any worker show up everywhere. The book write routes also update it straight away locally.
+import math
+import re
+import threading
+from array import array
+
+import numpy as np
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal
+from utils.versions import next_version, VersionWatermark
+
+# Default share of the query trigrams a book must contain to be returned
+FUZZY_DEFAULT_THRESHOLD = 0.3
+# Rows read per round trip while building the index from the database
+INDEX_LOAD_BATCH_SIZE = 10000
+# How often every worker reads the books changed since its last refresh
+INDEX_REFRESH_SECONDS = 5
+# Posting lists are compacted once this many removed / updated books are left in them
+COMPACT_MIN_DEAD = 1000
+# A trigram found in more than 1/128th of the books (and at least 1000 of them), like the ones of "the",
+# is common. Common trigrams are not scanned, they are only looked up in a bitmap for books which
+# already matched a distinctive trigram of the query.
+COMMON_TRIGRAM_RATIO = 128
+COMMON_TRIGRAM_MIN_BOOKS = 1000
+
+_WORD_SPLIT = re.compile(r"[^\w]+")
+
+
+# Trigrams of a text, words are lower cased and padded with two spaces in front and one behind,
+# so "Dune" gives "  d", " du", "dun", "une", "ne ".
+def trigrams(text: str):
+    grams = set()
+    for word in _WORD_SPLIT.split(text.lower()):
+        if not word:
+            continue
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+class TrigramIndex:
+    def __init__(self):
+        # trigram -> slots of the books containing it, kept as compact int32 arrays
+        self._postings = {}
+        # per slot data, a slot is given to every indexed version of a book
+        self._slot_book = array("i")
+        self._slot_size = array("i")
+        self._slot_version = array("i")
+        self._alive = array("b")
+        # book id -> its current slot, and the sum of those ids to compare with the table
+        self._book_slot = {}
+        self._id_sum = 0
+        # common trigram -> (bitmap of its slots, posting length already in the bitmap), built on first use
+        self._bitmaps = {}
+        self._dead = 0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._watermark = VersionWatermark(INDEX_REFRESH_SECONDS)
+        # set once the first refresh has read every book
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._book_slot)
+
+    # Brings the index up to date with the books table. The first call reads every book, later ones
+    # only the books added or renamed since (by version), then deleted books are dropped.
+    def refresh(self, db: Session):
+        with self._refresh_lock:
+            since = self._watermark.begin()
+            rows = db.query(models.Book.id, models.Book.title, models.Book.author, models.Book.version)
+            if self.loaded:
+                rows = rows.filter(models.Book.version > since)
+            rows = rows.execution_options(yield_per=INDEX_LOAD_BATCH_SIZE)
+            highest = 0
+            for book_id, title, author, version in rows:
+                # rows re-read because of the watermark overlap are already indexed, and a book renamed
+                # through this worker meanwhile may already be indexed at a newer version
+                indexed = self._indexed_version(book_id)
+                if indexed is None or indexed < version:
+                    self.add(book_id, title, author, version)
+                highest = max(highest, version)
+            self._watermark.end(highest)
+
+            # deletes leave no row to read, they show up as a different count / sum of the ids than indexed
+            if tuple(db.query(func.count(models.Book.id), func.coalesce(func.sum(models.Book.id), 0)).one()) != (len(self), self._id_sum):
+                self._sync_ids(db)
+            self.loaded = True
+
+    # Full comparison of the book ids, drops the books deleted from the table and indexes any book
+    # missing from the index (e.g. inserted outside the ORM without a version)
+    def _sync_ids(self, db: Session):
+        table_ids = {book_id for (book_id,) in db.query(models.Book.id).execution_options(yield_per=INDEX_LOAD_BATCH_SIZE)}
+        with self._lock:
+            gone = [book_id for book_id in self._book_slot if book_id not in table_ids]
+            missing = [book_id for book_id in table_ids if book_id not in self._book_slot]
+
+        for start in range(0, len(gone), INDEX_LOAD_BATCH_SIZE):
+            chunk = gone[start:start + INDEX_LOAD_BATCH_SIZE]
+            # a book added by this worker after the ids were read is not in table_ids, check again
+            still_there = {book_id for (book_id,) in db.query(models.Book.id).filter(models.Book.id.in_(chunk))}
+            for book_id in chunk:
+                if book_id not in still_there:
+                    self.remove(book_id)
+
+        for start in range(0, len(missing), INDEX_LOAD_BATCH_SIZE):
+            chunk = missing[start:start + INDEX_LOAD_BATCH_SIZE]
+            for book_id, title, author, version in db.query(
+                models.Book.id, models.Book.title, models.Book.author, models.Book.version
+            ).filter(models.Book.id.in_(chunk)):
+                self.add(book_id, title, author, version)
+
+    def _indexed_version(self, book_id: int):
+        slot = self._book_slot.get(book_id)
+        return None if slot is None else self._slot_version[slot]
+
+    # Adds a book, or re-indexes it when its title / author changed
+    def add(self, book_id: int, title: str, author: str, version: int = 0):
+        grams = trigrams(title) | trigrams(author)
+        with self._lock:
+            self._remove(book_id)
+            slot = len(self._slot_book)
+            self._slot_book.append(book_id)
+            self._slot_size.append(len(grams))
+            self._slot_version.append(version)
+            self._alive.append(1)
+            for gram in grams:
+                posting = self._postings.get(gram)
+                if posting is None:
+                    posting = self._postings[gram] = array("i")
+                posting.append(slot)
+            self._book_slot[book_id] = slot
+            self._id_sum += book_id
+
+    def remove(self, book_id: int):
+        with self._lock:
+            self._remove(book_id)
+
+    # Old slots are only flagged dead, they are dropped from the posting lists in bulk by _compact
+    def _remove(self, book_id: int):
+        slot = self._book_slot.pop(book_id, None)
+        if slot is None:
+            return
+        self._alive[slot] = 0
+        self._id_sum -= book_id
+        self._dead += 1
+        if self._dead >= COMPACT_MIN_DEAD and self._dead > len(self._book_slot):
+            self._compact()
+
+    def _compact(self):
+        alive = np.frombuffer(self._alive, dtype=np.int8).astype(bool)
+        # old slot -> new slot, counting only live slots
+        new_slot = np.cumsum(alive, dtype=np.int32) - 1
+
+        for gram, posting in list(self._postings.items()):
+            slots = np.frombuffer(posting, dtype=np.int32)
+            kept = new_slot[slots[alive[slots]]]
+            del slots
+            if len(kept):
+                self._postings[gram] = array("i", kept.tobytes())
+            else:
+                del self._postings[gram]
+
+        self._slot_book = array("i", np.frombuffer(self._slot_book, dtype=np.int32)[alive].tobytes())
+        self._slot_size = array("i", np.frombuffer(self._slot_size, dtype=np.int32)[alive].tobytes())
+        self._slot_version = array("i", np.frombuffer(self._slot_version, dtype=np.int32)[alive].tobytes())
+        self._alive = array("b", [1]) * len(self._slot_book)
+        self._book_slot = {book_id: slot for slot, book_id in enumerate(self._slot_book)}
+        self._bitmaps = {}
+        self._dead = 0
+
+    # Returns [(book_id, similarity)] best first. similarity is the share of the query trigrams found
+    # in the book, ties are broken by how close the whole title + author is to the query.
+    # A book has to share at least one distinctive (not common) trigram with the query, so a query made
+    # of stop words only, like "the", matches nothing.
+    def search(self, query: str, threshold: float = FUZZY_DEFAULT_THRESHOLD, limit: int = 20):
+        grams = trigrams(query)
+        if not grams:
+            return []
+        # a book has to contain at least this many of the query trigrams
+        needed = max(1, math.ceil(threshold * len(grams)))
+
+        with self._lock:
+            slot_count = len(self._slot_book)
+            common_length = max(COMMON_TRIGRAM_MIN_BOOKS, slot_count // COMMON_TRIGRAM_RATIO)
+            rare, common = [], []
+            for gram in grams:
+                posting = self._postings.get(gram)
+                if posting is None:
+                    continue
+                if len(posting) >= common_length:
+                    common.append(self._bitmap(gram, posting, slot_count))
+                else:
+                    rare.append(posting)
+
+            # Count for every book how many distinctive query trigrams it contains, all in numpy
+            counts = np.zeros(slot_count, dtype=np.uint8 if len(grams) < 256 else np.uint16)
+            for posting in rare:
+                counts[np.frombuffer(posting, dtype=np.int32)] += 1
+
+            # the common trigrams can add at most len(common) more matches
+            slots = np.flatnonzero(counts >= max(1, needed - len(common)))
+            matched = counts[slots].astype(np.int32)
+            for bits in common:
+                matched += (bits[slots >> 3] >> (slots & 7)) & 1
+
+            alive = np.frombuffer(self._alive, dtype=np.int8)[slots] == 1
+            keep = alive & (matched >= needed)
+            slots, matched = slots[keep], matched[keep]
+            sizes = np.frombuffer(self._slot_size, dtype=np.int32)[slots]
+            book_ids = np.frombuffer(self._slot_book, dtype=np.int32)[slots]
+
+        similarity = matched / len(grams)
+        closeness = matched / (len(grams) + sizes - matched)
+        # lexsort sorts by the last key first
+        order = np.lexsort((book_ids, -closeness, -similarity))[:limit]
+        return [(int(book_ids[i]), float(similarity[i])) for i in order]
+
+    # Bitmap (one bit per slot) of a common trigram. Posting lists only grow at the end until the next
+    # compaction, so only the slots added since the last search have to be set.
+    def _bitmap(self, gram: str, posting: array, slot_count: int):
+        bits, indexed = self._bitmaps.get(gram, (None, 0))
+        size = (slot_count + 7) // 8
+        slots = np.frombuffer(posting, dtype=np.int32)
+
+        if bits is None:
+            present = np.zeros(size * 8, dtype=bool)
+            present[slots] = True
+            bits = np.packbits(present, bitorder="little")
+        else:
+            if len(bits) < size:
+                # grow with some room so the bitmap is not copied on every new book
+                grown = np.zeros(size + size // 2, dtype=np.uint8)
+                grown[:len(bits)] = bits
+                bits = grown
+            added = slots[indexed:]
+            np.bitwise_or.at(bits, added >> 3, (1 << (added & 7)).astype(np.uint8))
+            del added
+        del slots
+
+        self._bitmaps[gram] = (bits, len(posting))
+        return bits
+
+
+# Shared index used by the books router
+book_index = TrigramIndex()
+
+
+# Run by every worker in the background, see main.py
+def refresh_book_index():
+    db = SessionLocal()
+    try:
+        book_index.refresh(db)
+    finally:
+        db.close()
+
+
+# Books get a new version when they are added and whenever their title or author change, other
+# updates (e.g. the quantity on every checkout) do not need re-indexing
+@event.listens_for(models.Book, "before_insert")
+def _stamp_new_book(mapper, connection, book):
+    book.version = next_version(models.book_version_seq, models.Book.version)
+
+
+@event.listens_for(models.Book, "before_update")
+def _stamp_renamed_book(mapper, connection, book):
+    state = inspect(book)
+    if state.attrs.title.history.has_changes() or state.attrs.author.history.has_changes():
+        book.version = next_version(models.book_version_seq, models.Book.version)
@@ -0,0 +1,45 @@
+# Row versions stamped by the database. The in process caches (token generations, fuzzy search index)
+# refresh by reading only the rows whose version is above what they have already seen, so they never
+# depend on the clocks of the app hosts agreeing with each other.
+import time
+from collections import deque
+
+from sqlalchemy import Sequence, func, select
+
+from database import IS_SQLITE
+
+
+# SQL expression for the next version of a row, assigned to the version column before it is written.
+# It is evaluated by the database when the row is flushed, after any row lock has been taken.
+def next_version(sequence: Sequence, column):
+    if IS_SQLITE:
+        # sqlite has a single writer, the highest version plus one is always increasing
+        return select(func.coalesce(func.max(column), 0) + 1).scalar_subquery()
+    return sequence.next_value()
+
+
+# Where to read from on the next refresh. Versions are handed out when a row is flushed, a moment before
+# its commit, so a row can become visible after a higher version was already read. Every refresh therefore
+# starts from the highest version known overlap_seconds ago (on this process's own clock), not from the
+# highest one. Versions start at 1, reading from 0 reads everything.
+class VersionWatermark:
+    def __init__(self, overlap_seconds: float):
+        self._overlap = overlap_seconds
+        # (monotonic time a refresh started, highest version known after it)
+        self._reads = deque()
+        self._started_at = None
+
+    # Lowest version (exclusive) the refresh starting now has to read
+    def begin(self):
+        now = self._started_at = time.monotonic()
+        while len(self._reads) > 1 and now - self._reads[1][0] >= self._overlap:
+            self._reads.popleft()
+        if self._reads and now - self._reads[0][0] >= self._overlap:
+            return self._reads[0][1]
+        return 0
+
+    # Records the versions read by the refresh started with begin()
+    def end(self, highest: int):
+        if self._reads:
+            highest = max(highest, self._reads[-1][1])
+        self._reads.append((self._started_at, highest))